@@ -0,0 +1,282 @@
+"""
+Nearest-neighbour indexes for normalized face embeddings
+Exact brute-force search and an approximate IVF-flat index share one interface:
+
+    index.build(vectors)            - (re)build from an (n, dim) matrix
+    index.add(vectors)              - append vectors, rows continue from ntotal
+    index.search(query, k, vectors=matrix) - (rows, scores), best first
+    index.save(path) / load_index(path)
+
+Rows are insertion positions, so they line up with TemplateStore rows. The
+IVF index stores only which rows belong to each list and scores them from
+the caller's matrix (the template store's), so gallery vectors are held in
+memory once.
+"""
+
+import numpy as np
+
+# Gallery rows scored per task; 64k x 512 float32 is 128 MB of bandwidth
+SEARCH_CHUNK_ROWS = 65536
+
+
+def _chunk_top_k(matrix, probe, start, stop, k):
+    """Top-k (rows, scores) of matrix[start:stop] against the probe"""
+    scores = matrix[start:stop] @ probe
+    k = min(k, len(scores))
+    top = np.argpartition(scores, len(scores) - k)[-k:]
+    return top + start, scores[top]
+
+
+def top_k_cosine(matrix, probe, k, executor=None):
+    """Rows of matrix with the highest dot product against probe
+
+    Rows and probe are unit length, so the dot product is cosine similarity.
+    Large galleries are split into chunks scored in parallel (NumPy releases
+    the GIL), which spreads the matrix read over several cores' memory
+    bandwidth. Returns (rows, scores) sorted by descending score.
+    """
+    n = len(matrix)
+    if n == 0 or k <= 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+    bounds = [(start, min(start + SEARCH_CHUNK_ROWS, n)) for start in range(0, n, SEARCH_CHUNK_ROWS)]
+    if executor is None or len(bounds) == 1:
+        parts = [_chunk_top_k(matrix, probe, start, stop, k) for start, stop in bounds]
+    else:
+        parts = list(executor.map(lambda b: _chunk_top_k(matrix, probe, b[0], b[1], k), bounds))
+
+    rows = np.concatenate([p[0] for p in parts])
+    scores = np.concatenate([p[1] for p in parts])
+    order = np.argsort(-scores, kind='stable')[:k]
+    return rows[order], scores[order]
+
+
+def _grow(array, min_rows):
+    """Copy of array with capacity for at least min_rows rows"""
+    capacity = max(min_rows, 2 * len(array), 16)
+    grown = np.empty((capacity,) + array.shape[1:], dtype=array.dtype)
+    grown[:len(array)] = array
+    return grown
+
+
+class ExactIndex:
+    """Brute-force cosine search; the recall baseline for approximate indexes"""
+
+    kind = 'exact'
+
+    def __init__(self, dim=512):
+        self.dim = dim
+        self._vectors = np.empty((0, dim), dtype=np.float32)
+        self.ntotal = 0
+
+    @property
+    def params(self):
+        return {}
+
+    def build(self, vectors):
+        self._vectors = np.array(vectors, dtype=np.float32).reshape(-1, self.dim)
+        self.ntotal = len(self._vectors)
+
+    def add(self, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        if self.ntotal + len(vectors) > len(self._vectors):
+            self._vectors = _grow(self._vectors, self.ntotal + len(vectors))
+        self._vectors[self.ntotal:self.ntotal + len(vectors)] = vectors
+        self.ntotal += len(vectors)
+
+    def search(self, query, k, executor=None, nprobe=None, vectors=None):
+        # nprobe and vectors are accepted so callers can treat every index alike
+        query = np.asarray(query, dtype=np.float32).reshape(self.dim)
+        return top_k_cosine(self._vectors[:self.ntotal], query, k, executor)
+
+    def save(self, path):
+        np.savez(path, kind=self.kind, dim=self.dim, vectors=self._vectors[:self.ntotal])
+
+    @classmethod
+    def _from_arrays(cls, data):
+        index = cls(int(data['dim']))
+        index.build(data['vectors'])
+        return index
+
+
+def train_centroids(vectors, nlist, iterations=10, max_samples=None, seed=0):
+    """Spherical k-means: nlist unit-length centroids for cosine search"""
+    rng = np.random.default_rng(seed)
+    if max_samples is None:
+        max_samples = 64 * nlist
+    if len(vectors) > max_samples:
+        vectors = vectors[rng.choice(len(vectors), max_samples, replace=False)]
+    centroids = vectors[rng.choice(len(vectors), nlist, replace=False)].copy()
+
+    for _ in range(iterations):
+        assignment = assign_to_centroids(vectors, centroids)
+        counts = np.bincount(assignment, minlength=nlist)
+
+        # Per-cluster sums via one sort and a segmented reduction
+        order = np.argsort(assignment, kind='stable')
+        present = np.flatnonzero(counts)
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])[present]
+        sums = np.zeros_like(centroids)
+        sums[present] = np.add.reduceat(vectors[order], starts, axis=0)
+
+        # Re-seed empty clusters from random training vectors
+        empty = np.flatnonzero(counts == 0)
+        if len(empty):
+            sums[empty] = vectors[rng.choice(len(vectors), len(empty), replace=False)]
+        centroids = sums / np.maximum(np.linalg.norm(sums, axis=1, keepdims=True), 1e-12)
+    return centroids.astype(np.float32)
+
+
+def assign_to_centroids(vectors, centroids, chunk_rows=16384):
+    """Index of the closest centroid for every vector"""
+    assignment = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), chunk_rows):
+        scores = vectors[start:start + chunk_rows] @ centroids.T
+        assignment[start:start + chunk_rows] = np.argmax(scores, axis=1)
+    return assignment
+
+
+class IVFFlatIndex:
+    """Inverted-file index with uncompressed vectors
+
+    A coarse quantizer of nlist centroids partitions the gallery; a query
+    scores its nprobe closest centroids' lists only, so a probe reads
+    roughly nprobe / nlist of the gallery. Lists hold row numbers in
+    ascending order; the vectors are read from the matrix passed to search().
+    Raise nprobe for recall, lower it for latency.
+    """
+
+    kind = 'ivf_flat'
+
+    def __init__(self, dim=512, nlist=0, nprobe=16, train_iterations=10):
+        self.dim = dim
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.train_iterations = train_iterations
+        self.centroids = None
+        self.ntotal = 0
+        self.trained_size = 0
+        self._list_rows = []
+        self._list_sizes = np.zeros(0, dtype=np.int64)
+
+    @property
+    def params(self):
+        return {'nlist': self.nlist, 'nprobe': self.nprobe}
+
+    @property
+    def is_trained(self):
+        return self.centroids is not None
+
+    @staticmethod
+    def default_nlist(n):
+        """About 4 * sqrt(n) lists, the usual IVF starting point"""
+        return int(max(1, min(n // 39, 4 * np.sqrt(n))))
+
+    def build(self, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        if len(vectors) == 0:
+            raise ValueError("Cannot train an IVF index without vectors")
+        if not self.nlist:
+            self.nlist = self.default_nlist(len(vectors))
+        self.nlist = min(self.nlist, len(vectors))
+        self.centroids = train_centroids(vectors, self.nlist, self.train_iterations)
+        self.trained_size = len(vectors)
+        self._list_rows = [np.empty(0, dtype=np.int64) for _ in range(self.nlist)]
+        self._list_sizes = np.zeros(self.nlist, dtype=np.int64)
+        self.ntotal = 0
+        self.add(vectors)
+
+    def add(self, vectors):
+        if not self.is_trained:
+            raise RuntimeError("IVF index must be built before adding vectors")
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        rows = np.arange(self.ntotal, self.ntotal + len(vectors), dtype=np.int64)
+        assignment = assign_to_centroids(vectors, self.centroids)
+
+        # Group the new vectors by list and append each group in one copy
+        order = np.argsort(assignment, kind='stable')
+        lists, starts = np.unique(assignment[order], return_index=True)
+        ends = np.append(starts[1:], len(order))
+        for list_id, start, end in zip(lists, starts, ends):
+            members = order[start:end]
+            size = self._list_sizes[list_id]
+            new_size = size + len(members)
+            if new_size > len(self._list_rows[list_id]):
+                self._list_rows[list_id] = _grow(self._list_rows[list_id], new_size)
+            self._list_rows[list_id][size:new_size] = rows[members]
+            self._list_sizes[list_id] = new_size
+        self.ntotal += len(vectors)
+
+    def search(self, query, k, executor=None, nprobe=None, vectors=None):
+        """Top-k rows of vectors (the indexed matrix, row-aligned) among the nprobe closest lists"""
+        if vectors is None:
+            raise ValueError("IVF search needs the indexed vectors")
+        query = np.asarray(query, dtype=np.float32).reshape(self.dim)
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+        if self.ntotal == 0 or k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        centroid_scores = self.centroids @ query
+        probe_lists = np.argpartition(centroid_scores, self.nlist - nprobe)[-nprobe:]
+        rows = [self._list_rows[i][:self._list_sizes[i]] for i in probe_lists if self._list_sizes[i]]
+        if not rows:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        # One gather of the candidate rows; sorted rows keep the reads in memory order
+        rows = np.sort(np.concatenate(rows))
+        scores = vectors[rows] @ query
+        if len(scores) > k:
+            top = np.argpartition(scores, len(scores) - k)[-k:]
+            rows, scores = rows[top], scores[top]
+        order = np.argsort(-scores, kind='stable')[:k]
+        return rows[order], scores[order]
+
+    def save(self, path):
+        sizes = self._list_sizes
+        np.savez(
+            path,
+            kind=self.kind,
+            dim=self.dim,
+            nlist=self.nlist,
+            nprobe=self.nprobe,
+            ntotal=self.ntotal,
+            trained_size=self.trained_size,
+            centroids=self.centroids,
+            list_sizes=sizes,
+            rows=np.concatenate([r[:s] for r, s in zip(self._list_rows, sizes)])
+        )
+
+    @classmethod
+    def _from_arrays(cls, data):
+        index = cls(int(data['dim']), int(data['nlist']), int(data['nprobe']))
+        index.centroids = data['centroids']
+        index.ntotal = int(data['ntotal'])
+        index.trained_size = int(data['trained_size'])
+        index._list_sizes = data['list_sizes'].astype(np.int64)
+        offsets = np.concatenate([[0], np.cumsum(index._list_sizes)])
+        # Files from before lists held rows only also carry vectors; they are not loaded
+        rows = data['rows']
+        index._list_rows = [rows[offsets[i]:offsets[i + 1]].copy() for i in range(index.nlist)]
+        return index
+
+
+INDEX_TYPES = {
+    ExactIndex.kind: ExactIndex,
+    IVFFlatIndex.kind: IVFFlatIndex,
+}
+
+
+def create_index(kind, dim=512, **params):
+    """New, empty index of the given kind"""
+    if kind not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type '{kind}', expected one of {list(INDEX_TYPES)}")
+    return INDEX_TYPES[kind](dim, **params)
+
+
+def load_index(path):
+    """Index saved with index.save(path)"""
+    with np.load(path) as data:
+        kind = str(data['kind'])
+        if kind not in INDEX_TYPES:
+            raise ValueError(f"Unknown index type '{kind}' in {path}")
+        return INDEX_TYPES[kind]._from_arrays(data)
@@ -0,0 +1,125 @@
+"""
+Dynamic micro-batching for the ArcFace recognition model
+Aligned face crops from concurrent requests are embedded in one forward pass
+"""
+
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+
+import numpy as np
+
+
+class RecognitionBatcher:
+    """Collects aligned crops into batches of up to max_batch_size
+
+    A batch is dispatched as soon as it is full or max_wait_ms after its
+    first crop arrived, whichever comes first. While a batch is running new
+    crops queue up, so batches grow naturally with load.
+    """
+
+    def __init__(self, rec_model, max_batch_size=32, max_wait_ms=5.0):
+        self.rec_model = rec_model
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+
+        # Models exported with a fixed batch dimension can only run one crop
+        batch_dim = rec_model.input_shape[0]
+        if isinstance(batch_dim, int) and batch_dim > 0 and batch_dim < max_batch_size:
+            print(f"⚠️  Recognition model has fixed batch size {batch_dim}, batching limited")
+            self.max_batch_size = batch_dim
+
+        self.batch_sizes = Counter()
+        self._stats_lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="face-batcher", daemon=True)
+        self._thread.start()
+
+    @property
+    def crop_size(self):
+        return self.rec_model.input_size[0]
+
+    @property
+    def queue_depth(self):
+        """Crops waiting for a batch"""
+        return self._queue.qsize()
+
+    def submit(self, crop):
+        """Queue an aligned crop; returns a Future resolving to its embedding"""
+        future = Future()
+        self._queue.put((crop, future))
+        return future
+
+    def _collect(self, first):
+        """Gather more crops until the batch is full or the wait expires"""
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait_ms / 1000.0
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if item is None:
+                # Shutdown requested: finish this batch, then stop
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            # Skip crops whose waiter gave up; the rest can no longer be cancelled
+            batch = [(crop, future) for crop, future in self._collect(item) if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            crops = [crop for crop, _ in batch]
+            try:
+                embeddings = self.rec_model.get_feat(crops)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            with self._stats_lock:
+                self.batch_sizes[len(batch)] += 1
+            for (_, future), embedding in zip(batch, embeddings):
+                future.set_result(embedding)
+
+    def warm_up(self, rounds=1):
+        """Embed synthetic batches of every power-of-two size up to max_batch_size
+
+        Runs the model directly (not through the queue) and is not counted in
+        stats(); call it before the first request.
+        """
+        size = self.crop_size
+        crop = np.random.default_rng(0).integers(0, 256, (size, size, 3), dtype=np.uint8)
+        batch_sizes = sorted({1 << i for i in range(self.max_batch_size.bit_length())} | {self.max_batch_size})
+        for _ in range(rounds):
+            for n in batch_sizes:
+                self.rec_model.get_feat([crop] * n)
+
+    def stats(self):
+        """Batch-size distribution for tuning max_batch_size / max_wait_ms"""
+        with self._stats_lock:
+            histogram = dict(sorted(self.batch_sizes.items()))
+        batches = sum(histogram.values())
+        items = sum(size * count for size, count in histogram.items())
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait_ms,
+            "batches": batches,
+            "crops": items,
+            "mean_batch_size": round(items / batches, 2) if batches else 0.0,
+            "batch_size_histogram": {str(size): count for size, count in histogram.items()}
+        }
+
+    def shutdown(self):
+        self._queue.put(None)
+        self._thread.join()
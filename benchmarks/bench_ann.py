@@ -0,0 +1,158 @@
+"""
+Approximate nearest-neighbour benchmark
+Compares IVF-flat recall@k and latency against exact brute-force search.
+
+By default the gallery is synthetic: identities are random unit vectors and
+every template / probe is a noisy sample around one of them, which mimics
+several photos per person. Pass --embeddings to use real embeddings instead
+(a .npy matrix or a template store's embeddings.f32).
+
+Usage:
+    python benchmarks/bench_ann.py --size 1000000 --nprobe 1,4,16,64
+    python benchmarks/bench_ann.py --embeddings templates/embeddings.f32
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from ann_index import ExactIndex, IVFFlatIndex
+
+
+def normalize(vectors):
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def synthetic_gallery(size, dim, identities, noise, seed=0, chunk_rows=65536):
+    """Unit-length samples clustered around random identity centres"""
+    rng = np.random.default_rng(seed)
+    centres = normalize(rng.standard_normal((identities, dim)).astype(np.float32))
+    gallery = np.empty((size, dim), dtype=np.float32)
+    for start in range(0, size, chunk_rows):
+        rows = min(chunk_rows, size - start)
+        owners = rng.integers(0, identities, rows)
+        samples = centres[owners] + noise * rng.standard_normal((rows, dim)).astype(np.float32) / np.sqrt(dim)
+        gallery[start:start + rows] = normalize(samples)
+    return gallery, centres
+
+
+def load_embeddings(path, dim):
+    if path.endswith('.npy'):
+        vectors = np.load(path).astype(np.float32)
+    else:
+        vectors = np.fromfile(path, dtype=np.float32).reshape(-1, dim)
+    return normalize(vectors.reshape(-1, dim))
+
+
+def time_searches(index, queries, k, executor=None, nprobe=None, vectors=None):
+    """Results and per-query latencies (ms) for every query"""
+    results, latencies = [], []
+    for query in queries:
+        t0 = time.perf_counter()
+        rows, _ = index.search(query, k, executor, nprobe=nprobe, vectors=vectors)
+        latencies.append((time.perf_counter() - t0) * 1000)
+        results.append(rows)
+    return results, np.array(latencies)
+
+
+def recall_at(results, truth, k):
+    """Fraction of the exact top-k found in the approximate top-k"""
+    hits = [len(np.intersect1d(found[:k], expected[:k])) for found, expected in zip(results, truth)]
+    return float(np.mean(hits)) / k
+
+
+def main():
+    parser = argparse.ArgumentParser(description="IVF-flat vs exact search benchmark")
+    parser.add_argument('--size', type=int, default=200000, help="Synthetic gallery size")
+    parser.add_argument('--dim', type=int, default=512)
+    parser.add_argument('--identities', type=int, default=0, help="Synthetic identities (default: size / 5)")
+    parser.add_argument('--noise', type=float, default=1.0, help="Synthetic intra-identity noise")
+    parser.add_argument('--embeddings', help="Real embeddings (.npy or raw float32 .f32)")
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--nlist', type=int, default=0, help="IVF lists (default: ~4 * sqrt(size))")
+    parser.add_argument('--nprobe', default='1,4,16,64,128,256', help="Comma-separated nprobe values")
+    parser.add_argument('--output', default='benchmarks/results_ann.json')
+    args = parser.parse_args()
+
+    print("="*60)
+    print("🔎 ANN Index Benchmark")
+    print("="*60)
+
+    rng = np.random.default_rng(1)
+    if args.embeddings:
+        gallery = load_embeddings(args.embeddings, args.dim)
+        # Probes: perturbed copies of random gallery templates
+        picks = gallery[rng.integers(0, len(gallery), args.queries)]
+        queries = normalize(picks + 0.5 * rng.standard_normal(picks.shape).astype(np.float32) / np.sqrt(args.dim))
+    else:
+        identities = args.identities or max(1, args.size // 5)
+        gallery, centres = synthetic_gallery(args.size, args.dim, identities, args.noise)
+        owners = rng.integers(0, identities, args.queries)
+        queries = normalize(centres[owners] + args.noise * rng.standard_normal((args.queries, args.dim)).astype(np.float32) / np.sqrt(args.dim))
+    print(f"📥 Gallery: {len(gallery)} x {args.dim}, {len(queries)} queries, k={args.k}")
+
+    executor = ThreadPoolExecutor(max_workers=os.cpu_count() or 1)
+
+    exact = ExactIndex(args.dim)
+    exact.build(gallery)
+    truth, exact_ms = time_searches(exact, queries, args.k, executor)
+    print(f"✅ Exact: {exact_ms.mean():.2f} ms mean, {np.percentile(exact_ms, 95):.2f} ms p95")
+
+    ivf = IVFFlatIndex(args.dim, nlist=args.nlist)
+    t0 = time.perf_counter()
+    ivf.build(gallery)
+    build_s = time.perf_counter() - t0
+    print(f"✅ IVF-flat built in {build_s:.1f}s (nlist={ivf.nlist})")
+
+    runs = []
+    for nprobe in [int(n) for n in args.nprobe.split(',')]:
+        if nprobe > ivf.nlist:
+            continue
+        results, ivf_ms = time_searches(ivf, queries, args.k, nprobe=nprobe, vectors=gallery)
+        runs.append({
+            'nprobe': nprobe,
+            'recall_at_1': round(recall_at(results, truth, 1), 4),
+            f'recall_at_{args.k}': round(recall_at(results, truth, args.k), 4),
+            'latency_ms_mean': round(float(ivf_ms.mean()), 3),
+            'latency_ms_p95': round(float(np.percentile(ivf_ms, 95)), 3),
+            'speedup': round(float(exact_ms.mean() / ivf_ms.mean()), 1)
+        })
+
+    print(f"\n{'nprobe':>7s} {'R@1':>7s} {f'R@{args.k}':>7s} {'mean ms':>9s} {'p95 ms':>9s} {'speedup':>8s}")
+    print(f"{'exact':>7s} {1.0:7.3f} {1.0:7.3f} {exact_ms.mean():9.2f} {np.percentile(exact_ms, 95):9.2f} {1.0:7.1f}x")
+    for run in runs:
+        print(f"{run['nprobe']:7d} {run['recall_at_1']:7.3f} {run[f'recall_at_{args.k}']:7.3f} "
+              f"{run['latency_ms_mean']:9.2f} {run['latency_ms_p95']:9.2f} {run['speedup']:7.1f}x")
+
+    results = {
+        'gallery_size': len(gallery),
+        'dim': args.dim,
+        'queries': len(queries),
+        'k': args.k,
+        'exact': {
+            'latency_ms_mean': round(float(exact_ms.mean()), 3),
+            'latency_ms_p95': round(float(np.percentile(exact_ms, 95)), 3)
+        },
+        'ivf_flat': {
+            'nlist': ivf.nlist,
+            'build_seconds': round(build_s, 2),
+            'runs': runs
+        }
+    }
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=4)
+    print(f"\n✅ Results saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+Detection size benchmark
+Reports detection latency, detection recall and verification accuracy for
+each detector input size, plus the per-image 'auto' choice the server makes.
+
+Recall is the fraction of images with at least one detected face; accuracy
+is measured at the API threshold (65) on pairs where both faces were found.
+Pairs files use the CALFW/CPLFW layout read by evaluation/evaluate_all.py.
+
+Usage:
+    python benchmarks/bench_det_size.py --pairs-file pairs_CALFW.txt --images-dir "calfw/aligned images"
+    python benchmarks/bench_det_size.py --sizes 160,320,480,640 --max-pairs 500 ...
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+def load_pairs(pairs_file, max_pairs=None):
+    """(img1, img2, label) pairs: first half positives, second half negatives"""
+    with open(pairs_file) as f:
+        images = [line.split()[0] for line in f if line.strip()]
+    mid = len(images) // 2
+    pairs = []
+    for half, label in ((images[:mid], 1), (images[mid:], 0)):
+        pairs += [(half[i], half[i + 1], label) for i in range(0, len(half) - 1, 2)]
+    if max_pairs and len(pairs) > max_pairs:
+        # Fixed seed so every size sees the same pairs
+        picks = np.random.default_rng(0).choice(len(pairs), max_pairs, replace=False)
+        pairs = [pairs[i] for i in sorted(picks)]
+    return pairs
+
+
+def measure_size(face_model, rec_model, images, pairs, det_size):
+    """Detect every image at det_size (None = per-image choice) and score the pairs"""
+    import server
+    from insightface.utils import face_align
+
+    latencies, embeddings, chosen = [], {}, []
+    for name, image_bytes in images.items():
+        img = server.preprocess_image(image_bytes)
+        size = det_size or face_model.select_det_size(*img.shape[:2])
+        chosen.append(size)
+        t0 = time.perf_counter()
+        faces = face_model.get(img, det_size=size)
+        latencies.append((time.perf_counter() - t0) * 1000)
+        if faces:
+            crop = face_align.norm_crop(img, landmark=faces[0].kps, image_size=rec_model.input_size[0])
+            embeddings[name] = server.normalize_embedding(rec_model.get_feat(crop)[0])
+
+    correct = scored = 0
+    for img1, img2, label in pairs:
+        if img1 in embeddings and img2 in embeddings:
+            score = server.similarity_to_percent(np.dot(embeddings[img1], embeddings[img2]))
+            correct += int((score > 65.0) == bool(label))
+            scored += 1
+
+    return {
+        'det_size': det_size or 'auto',
+        'sizes_used': {str(s): int(c) for s, c in zip(*np.unique(chosen, return_counts=True))},
+        'detect_ms_mean': round(float(np.mean(latencies)), 2),
+        'detect_ms_p95': round(float(np.percentile(latencies, 95)), 2),
+        'recall': round(len(embeddings) / len(images), 4),
+        'pairs_scored': scored,
+        'accuracy': round(correct / scored, 4) if scored else None
+    }
+
+
+def main():
+    import config
+    from face_models import build_face_model, build_recognition_model
+
+    parser = argparse.ArgumentParser(description="Benchmark detector input sizes")
+    parser.add_argument('--pairs-file', required=True, help="Dataset pairs file")
+    parser.add_argument('--images-dir', required=True, help="Dataset image directory")
+    parser.add_argument('--max-pairs', type=int, default=1000, help="Pairs to sample (0 = all)")
+    parser.add_argument('--sizes', default=','.join(map(str, config.DET_SIZES)), help="Comma-separated sizes")
+    parser.add_argument('--output', default='benchmarks/results_det_size.json')
+    args = parser.parse_args()
+
+    print("="*60)
+    print("📐 Detection Size Benchmark")
+    print("="*60)
+
+    pairs = load_pairs(args.pairs_file, args.max_pairs)
+    names = sorted({name for pair in pairs for name in pair[:2]})
+    images = {name: (Path(args.images_dir) / name).read_bytes() for name in names}
+    print(f"📥 {len(pairs)} pairs, {len(images)} images")
+
+    sizes = sorted(int(s) for s in args.sizes.split(','))
+    config.DET_SIZES = sizes
+    face_model = build_face_model(1, 'fast')
+    rec_model = build_recognition_model()
+
+    runs = []
+    for det_size in sizes + [None]:
+        result = measure_size(face_model, rec_model, images, pairs, det_size)
+        runs.append(result)
+        print(f"✅ {result['det_size']}: {result['detect_ms_mean']} ms, recall {result['recall']}")
+
+    print(f"\n{'Size':>6s} {'Mean ms':>9s} {'p95 ms':>8s} {'Recall':>8s} {'Accuracy':>9s}")
+    for r in runs:
+        accuracy = f"{r['accuracy']:9.4f}" if r['accuracy'] is not None else f"{'-':>9s}"
+        print(f"{str(r['det_size']):>6s} {r['detect_ms_mean']:9.2f} {r['detect_ms_p95']:8.2f} {r['recall']:8.4f} {accuracy}")
+
+    results = {
+        'pairs_file': args.pairs_file,
+        'pairs': len(pairs),
+        'images': len(images),
+        'runs': runs
+    }
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=4)
+    print(f"\n✅ Results saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+"""
+Load generator
+Replays a JSONL log of image-pair requests against a running server and
+reports throughput, latency percentiles and error rates.
+
+Closed loop (--concurrency N): N clients each send their next request as
+soon as the previous one returns, which measures capacity.
+Open loop (--rps R): requests start on a fixed schedule (or Poisson
+arrivals) whether or not earlier ones finished, and latency is measured from
+the scheduled start. A slow server cannot hide queueing delay by slowing
+the client down (coordinated omission).
+
+Each log line is one request; image paths are relative to --images-dir:
+    {"image1": "a.jpg", "image2": "b.jpg"}
+    {"endpoint": "/verify_faces", "image1": "a.jpg", "image2": "b.jpg", "params": {"profile": "fast"}}
+    {"endpoint": "/identify", "image": "probe.jpg"}
+
+Usage:
+    python benchmarks/bench_load.py --log requests.jsonl --images-dir images/ --concurrency 8 --duration 60
+    python benchmarks/bench_load.py --pairs-file pairs_CALFW.txt --images-dir "calfw/aligned images" --rps 20
+    python benchmarks/bench_load.py ... --baseline benchmarks/results_load.json --output /tmp/run.json
+"""
+
+import argparse
+import itertools
+import json
+import os
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+import requests
+
+from bench_det_size import load_pairs
+
+
+def load_log(log_file):
+    """Request entries of a JSONL replay log"""
+    with open(log_file) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def pairs_to_log(pairs_file, max_pairs=None):
+    """Replay entries for a CALFW/CPLFW-style pairs file"""
+    return [{"image1": img1, "image2": img2} for img1, img2, _ in load_pairs(pairs_file, max_pairs)]
+
+
+def prepare_requests(entries, images_dir):
+    """(endpoint, params, files) per entry with every image read once up front"""
+    images = {}
+    prepared = []
+    for entry in entries:
+        files = []
+        for field, path in entry.items():
+            if not field.startswith('image') or not isinstance(path, str):
+                continue
+            if path not in images:
+                images[path] = (Path(images_dir) / path).read_bytes()
+            files.append((field, (os.path.basename(path), images[path], 'image/jpeg')))
+        prepared.append((entry.get('endpoint', '/verify_faces'), entry.get('params', {}), files))
+    return prepared, len(images)
+
+
+class LoadRunner:
+    """Sends prepared requests and records (start, latency, outcome) samples"""
+
+    def __init__(self, base_url, prepared, timeout):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self._requests = itertools.cycle(prepared)
+        self._requests_lock = threading.Lock()
+        self._local = threading.local()
+        self.samples = []
+        self._samples_lock = threading.Lock()
+
+    def next_request(self):
+        with self._requests_lock:
+            return next(self._requests)
+
+    def send(self, request, scheduled=None):
+        """Send one request; latency counts from scheduled when given (open loop)"""
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        endpoint, params, files = request
+        start = time.perf_counter()
+        try:
+            response = session.post(self.base_url + endpoint, params=params, files=files, timeout=self.timeout)
+            outcome = str(response.status_code)
+        except requests.RequestException as e:
+            outcome = type(e).__name__
+        end = time.perf_counter()
+        begin = scheduled if scheduled is not None else start
+        with self._samples_lock:
+            self.samples.append((begin, end - begin, outcome))
+
+    def closed_loop(self, concurrency, duration):
+        """concurrency clients sending back to back until duration elapses"""
+        deadline = time.perf_counter() + duration
+
+        def client():
+            while time.perf_counter() < deadline:
+                self.send(self.next_request())
+
+        threads = [threading.Thread(target=client, daemon=True) for _ in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def open_loop(self, rps, duration, max_inflight, poisson=False):
+        """Start requests at rps (fixed interval or Poisson arrivals) for duration"""
+        rng = np.random.default_rng(0)
+        with ThreadPoolExecutor(max_workers=max_inflight) as executor:
+            start = time.perf_counter()
+            scheduled = start
+            while scheduled < start + duration:
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                executor.submit(self.send, self.next_request(), scheduled)
+                scheduled += rng.exponential(1.0 / rps) if poisson else 1.0 / rps
+
+
+def summarize(samples, measured_from, measured_to):
+    """Throughput, latency percentiles and outcome counts of samples started in the window"""
+    window = [s for s in samples if measured_from <= s[0] < measured_to]
+    duration = measured_to - measured_from
+    outcomes = Counter(outcome for _, _, outcome in window)
+    latencies = np.array([latency for _, latency, outcome in window if outcome == '200']) * 1000
+    errors = sum(count for outcome, count in outcomes.items() if outcome != '200')
+
+    summary = {
+        'requests': len(window),
+        'duration_s': round(duration, 2),
+        'throughput_rps': round(len(latencies) / duration, 2) if duration > 0 else 0.0,
+        'error_rate': round(errors / len(window), 4) if window else 0.0,
+        'outcomes': dict(sorted(outcomes.items()))
+    }
+    if len(latencies):
+        summary['latency_ms'] = {
+            'mean': round(float(latencies.mean()), 2),
+            'p50': round(float(np.percentile(latencies, 50)), 2),
+            'p95': round(float(np.percentile(latencies, 95)), 2),
+            'p99': round(float(np.percentile(latencies, 99)), 2),
+            'max': round(float(latencies.max()), 2)
+        }
+    return summary
+
+
+def compare(results, baseline):
+    """Print the relative change of throughput and latency against a previous run"""
+    print(f"\n📊 Compared with {baseline['timestamp']} ({baseline['mode']}):")
+    rows = [('throughput_rps', results['throughput_rps'], baseline['throughput_rps'])]
+    for key in ('p50', 'p95', 'p99'):
+        if 'latency_ms' in results and 'latency_ms' in baseline:
+            rows.append((f"{key}_ms", results['latency_ms'][key], baseline['latency_ms'][key]))
+    rows.append(('error_rate', results['error_rate'], baseline['error_rate']))
+    for name, current, previous in rows:
+        change = f"{(current - previous) / previous * 100:+.1f}%" if previous else "-"
+        print(f"   {name:15s} {previous:10.2f} -> {current:10.2f}  {change}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay requests against a running server under load")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--log', help="JSONL replay log")
+    source.add_argument('--pairs-file', help="Build the log from a dataset pairs file")
+    parser.add_argument('--images-dir', default='.', help="Directory image paths are relative to")
+    parser.add_argument('--max-pairs', type=int, default=0, help="Pairs to sample from --pairs-file (0 = all)")
+    parser.add_argument('--url', default='http://localhost:8000', help="Server base URL")
+    mode = parser.add_mutually_exclusive_group(required=True)
+    mode.add_argument('--concurrency', type=int, help="Closed loop: number of concurrent clients")
+    mode.add_argument('--rps', type=float, help="Open loop: target requests per second")
+    parser.add_argument('--poisson', action='store_true', help="Open loop: Poisson arrivals instead of fixed intervals")
+    parser.add_argument('--max-inflight', type=int, default=256, help="Open loop: most requests in flight")
+    parser.add_argument('--duration', type=float, default=30.0, help="Seconds to measure")
+    parser.add_argument('--warmup', type=float, default=5.0, help="Seconds of load before measuring")
+    parser.add_argument('--timeout', type=float, default=60.0, help="Per-request timeout in seconds")
+    parser.add_argument('--baseline', help="Previous results JSON to compare against")
+    parser.add_argument('--output', default='benchmarks/results_load.json')
+    args = parser.parse_args()
+
+    print("="*60)
+    print("🔥 Load Test")
+    print("="*60)
+
+    entries = load_log(args.log) if args.log else pairs_to_log(args.pairs_file, args.max_pairs)
+    prepared, num_images = prepare_requests(entries, args.images_dir)
+    print(f"📥 {len(prepared)} requests, {num_images} images")
+
+    runner = LoadRunner(args.url, prepared, args.timeout)
+    total = args.warmup + args.duration
+    started = time.perf_counter()
+    if args.concurrency:
+        mode_name = f"closed loop, {args.concurrency} clients"
+        print(f"🚀 {mode_name}, {args.warmup:g}s warm-up + {args.duration:g}s")
+        runner.closed_loop(args.concurrency, total)
+    else:
+        mode_name = f"open loop, {args.rps:g} rps" + (" (poisson)" if args.poisson else "")
+        print(f"🚀 {mode_name}, {args.warmup:g}s warm-up + {args.duration:g}s")
+        runner.open_loop(args.rps, total, args.max_inflight, args.poisson)
+
+    summary = summarize(runner.samples, started + args.warmup, started + total)
+    results = {
+        'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'url': args.url,
+        'mode': mode_name,
+        'concurrency': args.concurrency,
+        'target_rps': args.rps,
+        'warmup_s': args.warmup,
+        **summary
+    }
+
+    print(f"\n✅ {summary['requests']} requests, {summary['throughput_rps']} rps, error rate {summary['error_rate']:.2%}")
+    if 'latency_ms' in summary:
+        latency = summary['latency_ms']
+        print(f"   Latency ms: p50 {latency['p50']}, p95 {latency['p95']}, p99 {latency['p99']}, max {latency['max']}")
+    print(f"   Outcomes: {summary['outcomes']}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(results, json.load(f))
+
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=4)
+    print(f"\n✅ Results saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""
+Pipeline profile benchmark
+Measures load-time memory and per-pair latency for each pipeline profile.
+Every profile runs in a fresh process so the RSS numbers do not overlap.
+
+Usage:
+    python benchmarks/bench_profiles.py [image1 image2] [--pairs 50]
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+def rss_mb():
+    """Current resident set size of this process in MB"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # Peak RSS (KB on Linux, bytes on macOS) where /proc is unavailable
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def load_images(image_paths):
+    """Encoded bytes of the two benchmark images"""
+    if image_paths:
+        return [Path(p).read_bytes() for p in image_paths]
+    
+    # Fall back to the sample photo bundled with insightface
+    import cv2
+    from insightface.data import get_image
+    img = get_image('t1')
+    return [
+        cv2.imencode('.jpg', img)[1].tobytes(),
+        cv2.imencode('.jpg', cv2.flip(img, 1))[1].tobytes()
+    ]
+
+
+def measure_profile(profile, images, pairs, results):
+    """Load one profile and time full pairs (runs in a child process)"""
+    import server
+    from face_models import build_face_model, build_recognition_model
+
+    rss_before = rss_mb()
+    t0 = time.perf_counter()
+    face_model = build_face_model(1, profile)
+    rec_model = build_recognition_model()
+    load_s = time.perf_counter() - t0
+    rss_loaded = rss_mb()
+
+    def run_pair():
+        embeddings = []
+        for i, image_bytes in enumerate(images):
+            crop = server.detect_face(face_model, image_bytes, f"image {i + 1}", rec_model.input_size[0])
+            embeddings.append(rec_model.get_feat(crop)[0])
+        e1, e2 = embeddings
+        return float(np.dot(e1, e2) / (np.linalg.norm(e1) * np.linalg.norm(e2)))
+
+    # Warm-up: first runs pay ONNX Runtime allocation costs
+    for _ in range(3):
+        run_pair()
+
+    latencies = []
+    for _ in range(pairs):
+        t0 = time.perf_counter()
+        run_pair()
+        latencies.append((time.perf_counter() - t0) * 1000)
+
+    results.put({
+        'profile': profile,
+        'modules': sorted(face_model.models) + ['recognition'],
+        'load_seconds': round(load_s, 2),
+        'rss_mb': round(rss_loaded - rss_before, 1),
+        'pair_ms_mean': round(float(np.mean(latencies)), 2),
+        'pair_ms_p50': round(float(np.percentile(latencies, 50)), 2),
+        'pair_ms_p95': round(float(np.percentile(latencies, 95)), 2),
+        'peak_rss_mb': round(rss_mb(), 1)
+    })
+
+
+def main():
+    from face_models import PIPELINE_PROFILES
+
+    parser = argparse.ArgumentParser(description="Benchmark pipeline profiles")
+    parser.add_argument('images', nargs='*', help="Two face images (default: insightface sample)")
+    parser.add_argument('--pairs', type=int, default=50, help="Timed pairs per profile")
+    parser.add_argument('--profiles', default=','.join(PIPELINE_PROFILES), help="Comma-separated profiles")
+    parser.add_argument('--output', default='benchmarks/results_profiles.json')
+    args = parser.parse_args()
+
+    if args.images and len(args.images) != 2:
+        parser.error("Pass exactly two images, or none to use the bundled sample")
+
+    images = load_images(args.images)
+    ctx = multiprocessing.get_context('spawn')
+
+    print("="*60)
+    print("⏱️  Pipeline Profile Benchmark")
+    print("="*60)
+
+    all_results = []
+    for profile in args.profiles.split(','):
+        results = ctx.Queue()
+        proc = ctx.Process(target=measure_profile, args=(profile, images, args.pairs, results))
+        proc.start()
+        result = results.get()
+        proc.join()
+        all_results.append(result)
+        print(f"✅ {profile}: {result['pair_ms_mean']} ms/pair, +{result['rss_mb']} MB RSS")
+
+    print(f"\n{'Profile':10s} {'Modules':>8s} {'Load s':>8s} {'RSS MB':>8s} {'Mean ms':>9s} {'p50 ms':>8s} {'p95 ms':>8s}")
+    for r in all_results:
+        print(f"{r['profile']:10s} {len(r['modules']):8d} {r['load_seconds']:8.2f} {r['rss_mb']:8.1f} "
+              f"{r['pair_ms_mean']:9.2f} {r['pair_ms_p50']:8.2f} {r['pair_ms_p95']:8.2f}")
+
+    by_name = {r['profile']: r for r in all_results}
+    if 'full' in by_name:
+        for r in all_results:
+            if r['profile'] == 'full':
+                continue
+            saved_ms = by_name['full']['pair_ms_mean'] - r['pair_ms_mean']
+            saved_mb = by_name['full']['rss_mb'] - r['rss_mb']
+            print(f"\n💡 {r['profile']} vs full: {saved_ms:.2f} ms saved per pair, {saved_mb:.1f} MB saved per replica")
+
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump(all_results, f, indent=4)
+    print(f"\n✅ Results saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
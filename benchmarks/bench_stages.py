@@ -0,0 +1,230 @@
+"""
+Stage micro-benchmarks
+Times each stage of the verification hot path in-process (no HTTP, no
+network) at several image resolutions:
+
+    decode      preprocess_image on the encoded upload
+    detect      detection at the server's per-image detector size
+    align       alignment crop of the first face
+    recognize   one crop through the recognition model
+    similarity  calculate_similarity on a pair (cache off): the full pipeline
+
+Images are the sample photo bundled with insightface (or --image), rescaled
+so the longer side matches each resolution and re-encoded as JPEG.
+
+Results can be saved as a baseline. Later runs are compared with it and
+exit with status 1 when a stage's median is slower than the baseline by
+more than --tolerance. CI can run this on every change to the hot path.
+
+Usage:
+    python benchmarks/bench_stages.py --save-baseline
+    python benchmarks/bench_stages.py --tolerance 0.15
+    python benchmarks/bench_stages.py --image face.jpg --resolutions 480,1080 --iterations 100
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import sys
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+DEFAULT_BASELINE = 'benchmarks/baseline_stages.json'
+
+
+def load_source_image(path=None):
+    """BGR source image: a file, or the sample photo bundled with insightface"""
+    if path:
+        img = cv2.imread(path)
+        if img is None:
+            raise SystemExit(f"❌ Cannot read image: {path}")
+        return img
+    from insightface.data import get_image
+    return get_image('t1')
+
+
+def encode_at(img, longest):
+    """JPEG bytes of img rescaled so its longer side is longest pixels"""
+    scale = longest / max(img.shape[:2])
+    size = (max(1, round(img.shape[1] * scale)), max(1, round(img.shape[0] * scale)))
+    interpolation = cv2.INTER_AREA if scale < 1 else cv2.INTER_CUBIC
+    resized = cv2.resize(img, size, interpolation=interpolation)
+    return cv2.imencode('.jpg', resized, [cv2.IMWRITE_JPEG_QUALITY, 90])[1].tobytes()
+
+
+def time_stage(fn, iterations, warmup):
+    """Median, p95 and mean milliseconds of fn() after warmup calls"""
+    for _ in range(warmup):
+        fn()
+    timings = []
+    for _ in range(iterations):
+        t0 = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - t0) * 1000)
+    return {
+        'median_ms': round(float(np.median(timings)), 3),
+        'p95_ms': round(float(np.percentile(timings, 95)), 3),
+        'mean_ms': round(float(np.mean(timings)), 3)
+    }
+
+
+def load_server():
+    """Load the server's models in-process with the embedding cache disabled"""
+    import server
+    from embedding_cache import EmbeddingCache
+
+    server.load_face_model()
+    if not server.model_pools:
+        raise SystemExit("❌ Models could not be loaded")
+    server.warm_up()
+    server.readiness["state"] = "ready"
+    server.embedding_cache = EmbeddingCache(0)
+    return server
+
+
+def run_benchmarks(server, source, resolutions, iterations, warmup):
+    """{'stage@resolution': timings} for every stage and resolution"""
+    from insightface.utils import face_align
+    from face_models import build_face_model
+
+    # A replica like the server's own, timed directly instead of through its pool
+    face_model = build_face_model(server.config.NUM_WORKERS, server.config.DEFAULT_PROFILE)
+    face_model.warm_up()
+    rec_model = server.batcher.rec_model
+    crop_size = server.batcher.crop_size
+    loop = asyncio.new_event_loop()
+
+    results = {}
+    for longest in resolutions:
+        image_bytes = encode_at(source, longest)
+        flipped_bytes = encode_at(cv2.flip(source, 1), longest)
+        img = server.preprocess_image(image_bytes)
+        faces = face_model.get(img)
+        if not faces:
+            print(f"⚠️  {longest}px: no face detected, align / recognize / similarity skipped")
+
+        stages = {
+            'decode': lambda: server.preprocess_image(image_bytes),
+            'detect': lambda: face_model.get(img),
+        }
+        if faces:
+            crop = face_align.norm_crop(img, landmark=faces[0].kps, image_size=crop_size)
+            stages['align'] = lambda: face_align.norm_crop(img, landmark=faces[0].kps, image_size=crop_size)
+            stages['recognize'] = lambda: rec_model.get_feat(crop)
+            stages['similarity'] = lambda: loop.run_until_complete(
+                server.calculate_similarity(image_bytes, flipped_bytes)
+            )
+
+        for stage, fn in stages.items():
+            key = f"{stage}@{longest}"
+            results[key] = time_stage(fn, iterations, warmup)
+            print(f"✅ {key:18s} median {results[key]['median_ms']:9.3f} ms, p95 {results[key]['p95_ms']:9.3f} ms")
+
+    loop.close()
+    return results
+
+
+def environment(image):
+    """Settings that make timings comparable between runs"""
+    import onnxruntime
+    import config
+    return {
+        'image': image or 'insightface:t1',
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+        'python': platform.python_version(),
+        'onnxruntime': onnxruntime.__version__,
+        'model': config.MODEL_NAME,
+        'workers': config.NUM_WORKERS,
+        'intra_op_threads': config.ORT_INTRA_OP_THREADS
+    }
+
+
+def compare_with_baseline(results, baseline, tolerance):
+    """Print per-stage change against the baseline; returns the regressed stages"""
+    if baseline['environment'] != results['environment']:
+        print("⚠️  Baseline was recorded in a different environment:")
+        for key, value in results['environment'].items():
+            if baseline['environment'].get(key) != value:
+                print(f"   {key}: {baseline['environment'].get(key)} -> {value}")
+
+    regressions = []
+    print(f"\n{'Stage':18s} {'Baseline':>10s} {'Current':>10s} {'Change':>8s}")
+    for key, timing in results['stages'].items():
+        previous = baseline['stages'].get(key)
+        if previous is None:
+            print(f"{key:18s} {'-':>10s} {timing['median_ms']:10.3f} {'new':>8s}")
+            continue
+        change = (timing['median_ms'] - previous['median_ms']) / previous['median_ms']
+        marker = ''
+        if change > tolerance:
+            regressions.append(key)
+            marker = '  ❌'
+        print(f"{key:18s} {previous['median_ms']:10.3f} {timing['median_ms']:10.3f} {change:+8.1%}{marker}")
+    return regressions
+
+
+def main():
+    import config
+
+    parser = argparse.ArgumentParser(description="Benchmark each stage of the verification pipeline")
+    parser.add_argument('--image', help="Source face image (default: insightface sample)")
+    parser.add_argument('--resolutions', default='320,640,1280,1920', help="Comma-separated longer sides in pixels")
+    parser.add_argument('--iterations', type=int, default=50, help="Timed calls per stage")
+    parser.add_argument('--warmup', type=int, default=5, help="Untimed calls per stage")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help="Baseline file to compare with / save to")
+    parser.add_argument('--save-baseline', action='store_true', help="Record this run as the new baseline")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="Allowed median slowdown (0.2 = 20%%)")
+    parser.add_argument('--output', default='benchmarks/results_stages.json')
+    args = parser.parse_args()
+
+    print("="*60)
+    print("⏱️  Stage Micro-Benchmarks")
+    print("="*60)
+
+    server = load_server()
+    resolutions = sorted(int(r) for r in args.resolutions.split(','))
+    stages = run_benchmarks(server, load_source_image(args.image), resolutions, args.iterations, args.warmup)
+    server.batcher.shutdown()
+    for pool in server.model_pools.values():
+        pool.shutdown()
+
+    results = {
+        'environment': environment(args.image),
+        'iterations': args.iterations,
+        'det_sizes': config.DET_SIZES,
+        'stages': stages
+    }
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=4)
+    print(f"\n✅ Results saved to {args.output}")
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=4)
+        print(f"✅ Baseline saved to {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print(f"💡 No baseline at {args.baseline}; run with --save-baseline to record one")
+        return
+
+    with open(args.baseline) as f:
+        regressions = compare_with_baseline(results, json.load(f), args.tolerance)
+    if regressions:
+        print(f"\n❌ {len(regressions)} stage(s) slower than baseline by more than {args.tolerance:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+    print(f"\n✅ No stage slower than baseline by more than {args.tolerance:.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Server configuration
+Every setting can be overridden with a FACE_* environment variable
+"""
+
+import os
+from pathlib import Path
+
+BASE_DIR = Path(__file__).parent
+
+# Root directory for InsightFace model packs (see download_models.py)
+MODELS_DIR = Path(os.getenv("FACE_MODELS_DIR", str(BASE_DIR / "models")))
+MODEL_NAME = os.getenv("FACE_MODEL_NAME", "buffalo_l")
+
+# Square detector input sizes prepared on every replica. Each image is
+# detected at the smallest size covering its longer side (the largest size
+# for bigger images); clients can pick one with ?det_size=
+DET_SIZES = sorted({int(s) for s in os.getenv("FACE_DET_SIZES", "160,320,640").split(",") if s.strip()})
+
+# Image decoding: uploads over MAX_IMAGE_PIXELS are rejected, and large JPEGs
+# are decoded at a reduced scale that keeps the longer side >= DECODE_MIN_SIDE
+MAX_IMAGE_PIXELS = int(os.getenv("FACE_MAX_IMAGE_PIXELS", "50000000"))
+DECODE_MIN_SIDE = int(os.getenv("FACE_DECODE_MIN_SIDE", "1280"))
+
+# Pipeline profiles to load (see face_models.PIPELINE_PROFILES) and the one
+# used when a request does not ask for a profile
+PROFILES = [p.strip() for p in os.getenv("FACE_PROFILES", "fast").split(",") if p.strip()]
+DEFAULT_PROFILE = os.getenv("FACE_DEFAULT_PROFILE", PROFILES[0])
+
+# Pre-forked server processes sharing the models copy-on-write (1 = single process)
+CPU_COUNT = os.cpu_count() or 1
+PROCESSES = int(os.getenv("FACE_PROCESSES", "1"))
+
+# Where models run: 'local' (inside every API process) or 'shm' (one inference
+# process fed by all API workers through shared-memory ring buffers)
+INFERENCE_MODE = os.getenv("FACE_INFERENCE_MODE", "local")
+SHM_SLOTS = int(os.getenv("FACE_SHM_SLOTS", "4"))  # request slots per API worker
+SHM_SLOT_MB = float(os.getenv("FACE_SHM_SLOT_MB", "12"))  # larger decoded images are downscaled
+SHM_TIMEOUT_S = float(os.getenv("FACE_SHM_TIMEOUT_S", "30"))
+
+# Number of model replicas serving inference per process (0 = cores / processes;
+# all cores for the single shm inference process)
+MODEL_PROCESSES = 1 if INFERENCE_MODE == "shm" else PROCESSES
+NUM_WORKERS = int(os.getenv("FACE_NUM_WORKERS", "0")) or max(1, CPU_COUNT // MODEL_PROCESSES)
+
+# ONNX Runtime session settings applied to every InsightFace model.
+# Intra-op threads default to cores / replicas (all cores for recognition).
+ORT_PROVIDERS = [p.strip() for p in os.getenv("FACE_ORT_PROVIDERS", "CPUExecutionProvider").split(",") if p.strip()]
+ORT_INTRA_OP_THREADS = int(os.getenv("FACE_ORT_INTRA_OP_THREADS", "0"))
+ORT_INTER_OP_THREADS = int(os.getenv("FACE_ORT_INTER_OP_THREADS", "1"))
+ORT_EXECUTION_MODE = os.getenv("FACE_ORT_EXECUTION_MODE", "sequential")  # sequential or parallel
+ORT_GRAPH_OPTIMIZATION = os.getenv("FACE_ORT_GRAPH_OPTIMIZATION", "all")  # disable, basic, extended or all
+ORT_ALLOW_SPINNING = os.getenv("FACE_ORT_ALLOW_SPINNING", "1") == "1"
+
+# Optimized graphs are saved here on first load and reused afterwards ('' disables)
+ORT_CACHE_DIR = os.getenv("FACE_ORT_CACHE_DIR", str(BASE_DIR / "ort_cache"))
+
+# Synthetic inference rounds run through every replica, detector size and
+# recognition batch size before /health reports ready (0 skips warm-up)
+WARMUP_ROUNDS = int(os.getenv("FACE_WARMUP_ROUNDS", "2"))
+
+# Recognition micro-batching: largest batch and longest wait for it to fill
+BATCH_MAX_SIZE = int(os.getenv("FACE_BATCH_MAX_SIZE", "32"))
+BATCH_MAX_WAIT_MS = float(os.getenv("FACE_BATCH_MAX_WAIT_MS", "5"))
+
+# Memory budget for the in-process embedding cache (0 disables it)
+CACHE_MAX_MB = float(os.getenv("FACE_CACHE_MAX_MB", "64"))
+
+# Directory of the persistent template store used by /enroll
+TEMPLATES_DIR = Path(os.getenv("FACE_TEMPLATES_DIR", str(BASE_DIR / "templates")))
+
+# Gallery search index for /identify: 'exact' or 'ivf_flat' (approximate).
+# The approximate index is only built once the gallery reaches INDEX_MIN_SIZE.
+INDEX_TYPE = os.getenv("FACE_INDEX", "exact")
+INDEX_MIN_SIZE = int(os.getenv("FACE_INDEX_MIN_SIZE", "100000"))
+IVF_NLIST = int(os.getenv("FACE_IVF_NLIST", "0"))  # 0 = about 4 * sqrt(gallery size)
+IVF_NPROBE = int(os.getenv("FACE_IVF_NPROBE", "16"))
+
+# Upper bounds for one /verify_batch request
+BATCH_MAX_IMAGES = int(os.getenv("FACE_BATCH_MAX_IMAGES", "512"))
+BATCH_MAX_PAIRS = int(os.getenv("FACE_BATCH_MAX_PAIRS", "100000"))
+
+# Admin endpoints (/admin/profile) require this token in an X-Admin-Token
+# header; they are disabled while it is empty
+ADMIN_TOKEN = os.getenv("FACE_ADMIN_TOKEN", "")
+PROFILE_MAX_SECONDS = float(os.getenv("FACE_PROFILE_MAX_SECONDS", "60"))
+
+HOST = os.getenv("FACE_HOST", "0.0.0.0")
+PORT = int(os.getenv("FACE_PORT", "8000"))
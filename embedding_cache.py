@@ -0,0 +1,83 @@
+"""
+Content-addressed embedding cache
+Repeated uploads of the same image skip decode, detection and recognition
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+
+# Approximate per-entry bookkeeping (key tuple, digest, dict node, array header)
+ENTRY_OVERHEAD_BYTES = 256
+
+
+class EmbeddingCache:
+    """LRU cache of normalized embeddings bounded by memory
+
+    Keys combine a hash of the uploaded bytes with everything else that
+    changes the embedding (model set, pipeline profile, ...).
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    @staticmethod
+    def make_key(image_bytes, *variant):
+        """Cache key for an uploaded image under a model configuration"""
+        digest = hashlib.blake2b(image_bytes, digest_size=16).digest()
+        return (digest,) + variant
+
+    def get(self, key):
+        """Cached embedding for key, or None"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            embedding = self._entries.get(key)
+            if embedding is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return embedding
+
+    def put(self, key, embedding):
+        """Store an embedding, evicting least recently used entries"""
+        if not self.enabled:
+            return
+        # Cached arrays are shared between requests
+        embedding.flags.writeable = False
+        size = embedding.nbytes + ENTRY_OVERHEAD_BYTES
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.current_bytes -= previous.nbytes + ENTRY_OVERHEAD_BYTES
+            self._entries[key] = embedding
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self.current_bytes -= evicted.nbytes + ENTRY_OVERHEAD_BYTES
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+            }
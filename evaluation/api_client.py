@@ -0,0 +1,79 @@
+"""
+Concurrent client for the verification API
+Sends image pairs to /verify_faces from a pool of threads, each keeping its
+own keep-alive connection, with a bounded number of requests in flight.
+Scores come back in the order the pairs were given.
+"""
+
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class VerificationClient:
+    """Pooled, concurrent /verify_faces client
+
+    concurrency is the number of requests in flight (one connection each);
+    a few more pairs are read ahead so the server is never left idle.
+    profile selects the pipeline profile (the server's default when None).
+    """
+
+    def __init__(self, api_url="http://localhost:8000/verify_faces", concurrency=8, timeout=30, profile=None):
+        self.api_url = api_url
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.profile = profile
+        self._local = threading.local()
+
+    def server_info(self):
+        """The server's /health report (model pack, default profile, ...)"""
+        health_url = self.api_url.rsplit('/', 1)[0] + '/health'
+        return self._session().get(health_url, timeout=self.timeout).json()
+
+    def _session(self):
+        """Keep-alive session of the calling thread"""
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=1)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            self._local.session = session
+        return session
+
+    def verify_pair(self, img1_path, img2_path):
+        """Similarity score (0-100) of one pair, or None if the request failed"""
+        try:
+            with open(img1_path, 'rb') as f1, open(img2_path, 'rb') as f2:
+                files = {
+                    'image1': ('img1.jpg', f1, 'image/jpeg'),
+                    'image2': ('img2.jpg', f2, 'image/jpeg')
+                }
+                params = {'profile': self.profile} if self.profile else None
+                response = self._session().post(self.api_url, files=files, params=params, timeout=self.timeout)
+
+            if response.status_code == 200:
+                return response.json()['similarity_score']
+            return None
+
+        except Exception as e:
+            print(f"⚠️  Error: {e}")
+            return None
+
+    def verify_pairs(self, path_pairs):
+        """Yield the score of every (img1_path, img2_path) pair, in input order
+
+        At most concurrency requests run at once and at most twice that many
+        are queued, so memory stays bounded for any number of pairs.
+        """
+        window = deque()
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="verify") as executor:
+            for img1_path, img2_path in path_pairs:
+                window.append(executor.submit(self.verify_pair, img1_path, img2_path))
+                if len(window) >= 2 * self.concurrency:
+                    yield window.popleft().result()
+            while window:
+                yield window.popleft().result()
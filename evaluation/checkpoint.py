@@ -0,0 +1,80 @@
+"""
+Evaluation checkpoints
+Every scored pair is appended to a JSONL file as soon as its score arrives,
+so an interrupted run (client crash, server restart) can be resumed without
+sending those pairs again. The first line records the run configuration,
+and a resume against a different server, model or profile is refused:
+
+    {"config": {"server": "http://localhost:8000/verify_faces", "model": "buffalo_l", "profile": "fast"}}
+    {"img1": "a.jpg", "img2": "b.jpg", "label": 1, "score": 87.3}
+"""
+
+import json
+import os
+
+
+class ScoreCheckpoint:
+    """Append-only JSONL log of pair scores
+
+    resume=True keeps the scores already in the file (available in
+    self.scores) after checking they were made with run_config;
+    fresh=True starts the file over. An existing checkpoint is never
+    overwritten without fresh=True. Raises ValueError when the file cannot
+    be used.
+    """
+
+    def __init__(self, path, run_config, resume=False, fresh=False):
+        self.path = path
+        # Compare in the form it takes once written to the file
+        self.run_config = json.loads(json.dumps(run_config))
+        self.scores = {}
+        has_scores = os.path.exists(path) and os.path.getsize(path) > 0
+        if has_scores and not (resume or fresh):
+            raise ValueError(f"{path} already exists: pass --resume to continue it or --fresh to start over")
+        resume = has_scores and not fresh
+
+        complete = True
+        if resume:
+            with open(path) as f:
+                header = f.readline()
+                try:
+                    recorded = json.loads(header).get('config')
+                except (json.JSONDecodeError, AttributeError):
+                    recorded = None
+                if recorded != self.run_config:
+                    raise ValueError(
+                        f"{path} was scored with {recorded}, this run uses {self.run_config}: "
+                        f"pass --fresh to start over"
+                    )
+                complete = header.endswith('\n')
+                for line in f:
+                    complete = line.endswith('\n')
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # Last line cut short by a crash
+                        continue
+                    self.scores[(entry['img1'], entry['img2'])] = entry['score']
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._file = open(path, 'a' if resume else 'w')
+        if not complete:
+            self._file.write('\n')
+        if not resume:
+            self._file.write(json.dumps({'config': self.run_config}) + '\n')
+            self._file.flush()
+
+    def __len__(self):
+        return len(self.scores)
+
+    def get(self, img1, img2):
+        """Score recorded for a pair, or None"""
+        return self.scores.get((img1, img2))
+
+    def record(self, img1, img2, label, score):
+        """Append one scored pair and flush it to disk"""
+        self.scores[(img1, img2)] = score
+        self._file.write(json.dumps({'img1': img1, 'img2': img2, 'label': label, 'score': score}) + '\n')
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
@@ -0,0 +1,121 @@
+"""
+Persistent embedding store for evaluation datasets
+Embeddings computed by the offline engine are kept on disk per pipeline
+fingerprint, so later runs only embed images that are new or changed.
+
+Layout of one store directory (<root>/<model>-<fingerprint>/):
+    embeddings.npy  - float32 matrix, one unit-length row per image (memory-mapped)
+    index.json      - image path -> [row, size, mtime_ns]; row -1 = no face found
+    meta.json       - what the fingerprint covers
+
+Rows of images that changed are not reclaimed; delete the directory to
+start over.
+"""
+
+import hashlib
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+
+
+def fingerprint(settings):
+    """Short stable hash of a dict of pipeline settings"""
+    key = json.dumps(settings, sort_keys=True, default=str)
+    return hashlib.blake2b(key.encode(), digest_size=8).hexdigest()
+
+
+class EmbeddingStore:
+    """Embeddings of image files for one model / pipeline fingerprint
+
+    An entry is reused only while the file keeps its size and modification
+    time; images without a detected face are remembered too, so they are not
+    retried on every run.
+    """
+
+    def __init__(self, root, settings):
+        self.settings = settings
+        name = f"{settings.get('model', 'model')}-{fingerprint(settings)}"
+        self.directory = Path(root) / name
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._embeddings_path = self.directory / "embeddings.npy"
+        self._index_path = self.directory / "index.json"
+        self._meta_path = self.directory / "meta.json"
+        if not self._meta_path.exists():
+            self._meta_path.write_text(json.dumps(settings, indent=4, sort_keys=True, default=str))
+
+        self.index = json.loads(self._index_path.read_text()) if self._index_path.exists() else {}
+        self.matrix = None
+        if self._embeddings_path.exists():
+            self.matrix = np.load(self._embeddings_path, mmap_mode='r')
+
+    def __len__(self):
+        return len(self.index)
+
+    @staticmethod
+    def _file_key(path):
+        stat = os.stat(path)
+        return stat.st_size, stat.st_mtime_ns
+
+    def get(self, paths):
+        """(embeddings, valid, missing) for paths
+
+        embeddings has a row per path (zeros unless cached with a face),
+        missing lists the positions that must be (re)computed.
+        """
+        dim = self.matrix.shape[1] if self.matrix is not None else 1
+        embeddings = np.zeros((len(paths), dim), dtype=np.float32)
+        valid = np.zeros(len(paths), dtype=bool)
+        missing = []
+        positions, rows = [], []
+        for i, path in enumerate(paths):
+            entry = self.index.get(os.path.abspath(path))
+            try:
+                current = self._file_key(path)
+            except OSError:
+                current = None
+            if entry is None or current is None or tuple(entry[1:]) != current:
+                missing.append(i)
+            elif entry[0] >= 0:
+                positions.append(i)
+                rows.append(entry[0])
+        if rows:
+            # One fancy-indexed read from the memory map
+            embeddings[positions] = self.matrix[np.array(rows)]
+            valid[positions] = True
+        return embeddings, valid, missing
+
+    def put(self, paths, embeddings, valid):
+        """Record embeddings (rows where valid) and no-face results for paths"""
+        new_rows = [i for i in range(len(paths)) if valid[i]]
+        start = self.matrix.shape[0] if self.matrix is not None else 0
+        if new_rows:
+            dim = embeddings.shape[1]
+            if self.matrix is not None and self.matrix.shape[1] != dim:
+                raise ValueError(f"Store {self.directory} holds {self.matrix.shape[1]}-d embeddings, got {dim}-d")
+            # .npy files cannot grow in place: write old + new rows to a new file
+            tmp_path = self.directory / f"embeddings.{os.getpid()}.tmp.npy"
+            combined = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.float32, shape=(start + len(new_rows), dim))
+            if start:
+                combined[:start] = self.matrix
+            combined[start:] = embeddings[new_rows]
+            combined.flush()
+            del combined
+            self.matrix = None
+            os.replace(tmp_path, self._embeddings_path)
+            self.matrix = np.load(self._embeddings_path, mmap_mode='r')
+
+        # Row of each valid path in the new file, in the order they were written
+        rows = dict(zip(new_rows, range(start, start + len(new_rows))))
+        for i, path in enumerate(paths):
+            try:
+                size, mtime_ns = self._file_key(path)
+            except OSError:
+                # Gone since it was read: leave it out, it is recomputed next run
+                continue
+            self.index[os.path.abspath(path)] = [rows.get(i, -1), size, mtime_ns]
+
+        tmp_path = self.directory / f"index.{os.getpid()}.tmp"
+        tmp_path.write_text(json.dumps(self.index))
+        os.replace(tmp_path, self._index_path)
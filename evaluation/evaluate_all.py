@@ -1,17 +1,42 @@
+import argparse
 import requests
 import os
 import json
-from sklearn.metrics import accuracy_score, precision_score, recall_score, roc_auc_score, roc_curve
 import numpy as np
 from tqdm import tqdm
 import matplotlib.pyplot as plt
+from api_client import VerificationClient
+from checkpoint import ScoreCheckpoint
+from verification_metrics import ScoreCurve, bootstrap_intervals, kfold_accuracy
 
 class FaceVerificationEvaluator:
     """Evaluate face verification model on multiple datasets"""
     
-    def __init__(self, api_url="http://localhost:8000/verify_faces"):
+    def __init__(self, api_url="http://localhost:8000/verify_faces", concurrency=8,
+                 folds=10, bootstrap_rounds=1000, fars=(1e-3, 1e-4), checkpoint_dir=None, resume=False,
+                 fresh=False, profile=None):
         self.api_url = api_url
+        self.client = VerificationClient(api_url, concurrency=concurrency, profile=profile)
+        self.folds = folds
+        self.bootstrap_rounds = bootstrap_rounds
+        self.fars = fars
+        self.checkpoint_dir = checkpoint_dir
+        self.resume = resume
+        self.fresh = fresh
+        self.profile = profile
+        self._run_config = None
         self.results = {}
+    
+    def run_config(self):
+        """What the scores depend on: server, its model pack and the profile used"""
+        if self._run_config is None:
+            info = self.client.server_info()
+            self._run_config = {
+                'server': self.api_url,
+                'model': info.get('model_name'),
+                'profile': self.profile or info.get('default_profile')
+            }
+        return self._run_config
         
     def load_pairs(self, pairs_file):
         """Load pairs from pairs text file
@@ -57,34 +82,11 @@ class FaceVerificationEvaluator:
     
     def verify_pair(self, img1_path, img2_path):
         """Send pair to API and get similarity score"""
-        try:
-            with open(img1_path, 'rb') as f1, open(img2_path, 'rb') as f2:
-                files = {
-                    'image1': ('img1.jpg', f1, 'image/jpeg'),
-                    'image2': ('img2.jpg', f2, 'image/jpeg')
-                }
-                
-                response = requests.post(self.api_url, files=files, timeout=30)
-                
-                if response.status_code == 200:
-                    result = response.json()
-                    return result['similarity_score']
-                else:
-                    return None
-                    
-        except Exception as e:
-            print(f"⚠️  Error: {e}")
-            return None
+        return self.client.verify_pair(img1_path, img2_path)
     
     def find_optimal_threshold(self, y_true, y_scores):
-        """Find optimal threshold using ROC curve"""
-        fpr, tpr, thresholds = roc_curve(y_true, y_scores)
-        
-        # Find threshold that maximizes (TPR - FPR)
-        optimal_idx = np.argmax(tpr - fpr)
-        optimal_threshold = thresholds[optimal_idx]
-        
-        return optimal_threshold
+        """Find optimal threshold using ROC curve (maximizes TPR - FPR)"""
+        return ScoreCurve(y_true, y_scores).youden()
     
     def evaluate_dataset(self, dataset_name, pairs_file, images_dir, max_pairs=None):
         """Evaluate model on a single dataset"""
@@ -96,31 +98,15 @@ class FaceVerificationEvaluator:
         print("📥 Loading pairs...")
         all_pairs = self.load_pairs(pairs_file)
         
-        # Apply balanced sampling if max_pairs is set
-        if max_pairs:
-            same_pairs = [p for p in all_pairs if p['label'] == 1]
-            diff_pairs = [p for p in all_pairs if p['label'] == 0]
-            
-            half = max_pairs // 2
-            pairs = same_pairs[:half] + diff_pairs[:half]
-            
-            print(f"✅ Loaded {len(pairs)} pairs (sampled from {len(all_pairs)})")
-        else:
-            pairs = all_pairs
-            print(f"✅ Loaded {len(pairs)} pairs")
-        
-        # Count labels
-        label_counts = {0: 0, 1: 0}
-        for p in pairs:
-            label_counts[p['label']] += 1
-        print(f"   Same person: {label_counts[1]}, Different: {label_counts[0]}")
+        pairs = self.select_pairs(all_pairs, max_pairs)
         
         y_true = []
         y_scores = []
         failed = 0
         
-        print(f"🔄 Processing pairs...")
-        for pair in tqdm(pairs, desc=f"{dataset_name}"):
+        valid_pairs = []
+        path_pairs = []
+        for pair in pairs:
             # Construct full paths
             img1_path = os.path.join(images_dir, pair['img1'])
             img2_path = os.path.join(images_dir, pair['img2'])
@@ -136,91 +122,147 @@ class FaceVerificationEvaluator:
                 failed += 1
                 continue
             
-            # Get similarity score
-            score = self.verify_pair(img1_path, img2_path)
-            
+            valid_pairs.append(pair)
+            path_pairs.append((img1_path, img2_path))
+        
+        # Scores already in the checkpoint are reused, failed pairs are retried
+        checkpoint = None
+        scores = [None] * len(valid_pairs)
+        if self.checkpoint_dir:
+            checkpoint_path = os.path.join(self.checkpoint_dir, f"{dataset_name}.jsonl")
+            try:
+                checkpoint = ScoreCheckpoint(checkpoint_path, self.run_config(), self.resume, self.fresh)
+            except ValueError as e:
+                print(f"❌ {e}")
+                return None
+            scores = [checkpoint.get(pair['img1'], pair['img2']) for pair in valid_pairs]
+            if self.resume:
+                print(f"♻️  Resuming from {checkpoint_path}: {sum(s is not None for s in scores)} pairs already scored")
+        todo = [i for i, score in enumerate(scores) if score is None]
+        
+        # Get similarity scores (concurrent requests, results in pair order)
+        print(f"🔄 Processing pairs ({self.client.concurrency} concurrent requests)...")
+        new_scores = self.client.verify_pairs([path_pairs[i] for i in todo])
+        for i, score in tqdm(zip(todo, new_scores), total=len(todo), desc=f"{dataset_name}"):
+            scores[i] = score
+            if score is not None and checkpoint is not None:
+                pair = valid_pairs[i]
+                checkpoint.record(pair['img1'], pair['img2'], pair['label'], score)
+        if checkpoint is not None:
+            checkpoint.close()
+        
+        for pair, score in zip(valid_pairs, scores):
             if score is not None:
                 y_true.append(pair['label'])
                 y_scores.append(score / 100.0)  # Normalize to [0,1]
             else:
                 failed += 1
         
-        if len(y_true) == 0:
-            print(f"❌ No valid pairs processed for {dataset_name}")
-            return None
-        
-        # Find optimal threshold
-        optimal_threshold = self.find_optimal_threshold(y_true, y_scores)
-        optimal_threshold_percent = optimal_threshold * 100
-        
-        # Calculate predictions with optimal threshold
-        y_pred_optimal = [1 if score >= optimal_threshold else 0 for score in y_scores]
-        
-        # Also calculate with default threshold (0.65)
-        default_threshold = 0.65
-        y_pred_default = [1 if score >= default_threshold else 0 for score in y_scores]
+        return self.compute_metrics(dataset_name, y_true, y_scores, len(pairs), failed)
+    
+    def evaluate_dataset_offline(self, dataset_name, pairs_file, images_dir, engine, max_pairs=None):
+        """Evaluate a dataset in-process with an OfflineEngine (no server needed)"""
+        print(f"\n{'='*60}")
+        print(f"📊 Evaluating {dataset_name} (offline)")
+        print(f"{'='*60}")
         
-        # Calculate metrics for optimal threshold
-        accuracy_optimal = accuracy_score(y_true, y_pred_optimal)
-        precision_optimal = precision_score(y_true, y_pred_optimal, zero_division=0)
-        recall_optimal = recall_score(y_true, y_pred_optimal, zero_division=0)
+        print("📥 Loading pairs...")
+        pairs = self.select_pairs(self.load_pairs(pairs_file), max_pairs)
         
-        # Calculate metrics for default threshold
-        accuracy_default = accuracy_score(y_true, y_pred_default)
-        precision_default = precision_score(y_true, y_pred_default, zero_division=0)
-        recall_default = recall_score(y_true, y_pred_default, zero_division=0)
+        # Embed each unique image once, then score all pairs in one pass
+        num_images = len({name for pair in pairs for name in (pair['img1'], pair['img2'])})
+        print(f"🔄 Embedding {num_images} unique images...")
+        with tqdm(total=num_images, desc=f"{dataset_name}") as progress:
+            y_true, y_scores, failed = engine.score_pairs(pairs, images_dir, progress)
         
-        # Calculate AUC
-        try:
-            auc = roc_auc_score(y_true, y_scores)
-        except:
-            auc = 0.0
+        return self.compute_metrics(dataset_name, y_true, y_scores, len(pairs), failed)
+    
+    def select_pairs(self, all_pairs, max_pairs=None):
+        """Balanced sample of max_pairs pairs (all pairs when max_pairs is None)"""
+        # Apply balanced sampling if max_pairs is set
+        if max_pairs:
+            same_pairs = [p for p in all_pairs if p['label'] == 1]
+            diff_pairs = [p for p in all_pairs if p['label'] == 0]
+            
+            half = max_pairs // 2
+            pairs = same_pairs[:half] + diff_pairs[:half]
+            
+            print(f"✅ Loaded {len(pairs)} pairs (sampled from {len(all_pairs)})")
+        else:
+            pairs = all_pairs
+            print(f"✅ Loaded {len(pairs)} pairs")
         
-        # Calculate True Acceptance Rate (TAR) and False Acceptance Rate (FAR)
-        # For optimal threshold
-        tp_opt = sum([1 for t, p in zip(y_true, y_pred_optimal) if t == 1 and p == 1])
-        fp_opt = sum([1 for t, p in zip(y_true, y_pred_optimal) if t == 0 and p == 1])
-        tn_opt = sum([1 for t, p in zip(y_true, y_pred_optimal) if t == 0 and p == 0])
-        fn_opt = sum([1 for t, p in zip(y_true, y_pred_optimal) if t == 1 and p == 0])
+        # Count labels
+        label_counts = {0: 0, 1: 0}
+        for p in pairs:
+            label_counts[p['label']] += 1
+        print(f"   Same person: {label_counts[1]}, Different: {label_counts[0]}")
         
-        tar_opt = tp_opt / (tp_opt + fn_opt) if (tp_opt + fn_opt) > 0 else 0
-        far_opt = fp_opt / (fp_opt + tn_opt) if (fp_opt + tn_opt) > 0 else 0
+        return pairs
+    
+    def compute_metrics(self, dataset_name, y_true, y_scores, total_pairs, failed=0):
+        """Verification metrics from labels and similarity scores in [0,1]"""
+        if len(y_true) == 0:
+            print(f"❌ No valid pairs processed for {dataset_name}")
+            return None
         
-        # For default threshold
-        tp_def = sum([1 for t, p in zip(y_true, y_pred_default) if t == 1 and p == 1])
-        fp_def = sum([1 for t, p in zip(y_true, y_pred_default) if t == 0 and p == 1])
-        tn_def = sum([1 for t, p in zip(y_true, y_pred_default) if t == 0 and p == 0])
-        fn_def = sum([1 for t, p in zip(y_true, y_pred_default) if t == 1 and p == 0])
+        # One sort of the scores gives the confusion counts at every threshold
+        curve = ScoreCurve(y_true, y_scores)
+        
+        def at_threshold(threshold):
+            tp, fp, tn, fn = (int(c) for c in curve.counts_at(threshold))
+            total = tp + fp + tn + fn
+            return {
+                'threshold': round(threshold * 100, 2),
+                'accuracy': round((tp + tn) / total * 100, 2),
+                'precision': round(tp / (tp + fp) * 100 if tp + fp else 0.0, 2),
+                'recall': round(tp / (tp + fn) * 100 if tp + fn else 0.0, 2),
+                'tar': round(tp / (tp + fn) * 100 if tp + fn else 0.0, 2),
+                'far': round(fp / (fp + tn) * 100 if fp + tn else 0.0, 2),
+                'tp': tp, 'fp': fp, 'tn': tn, 'fn': fn
+            }
         
-        tar_def = tp_def / (tp_def + fn_def) if (tp_def + fn_def) > 0 else 0
-        far_def = fp_def / (fp_def + tn_def) if (fp_def + tn_def) > 0 else 0
+        eer, eer_threshold = curve.eer()
+        tar_at_far = {}
+        for far in self.fars:
+            tar, threshold = curve.tar_at_far(far)
+            tar_at_far[f"{far:g}"] = {
+                'tar': round(tar * 100, 2),
+                'threshold': round(threshold * 100, 2) if np.isfinite(threshold) else None
+            }
         
         results = {
             'dataset': dataset_name,
-            'total_pairs': len(pairs),
+            'total_pairs': total_pairs,
             'evaluated_pairs': len(y_true),
             'failed_pairs': failed,
-            'auc': round(auc, 4),
-            'optimal_threshold': {
-                'threshold': round(optimal_threshold_percent, 2),
-                'accuracy': round(accuracy_optimal * 100, 2),
-                'precision': round(precision_optimal * 100, 2),
-                'recall': round(recall_optimal * 100, 2),
-                'tar': round(tar_opt * 100, 2),
-                'far': round(far_opt * 100, 2),
-                'tp': tp_opt, 'fp': fp_opt, 'tn': tn_opt, 'fn': fn_opt
-            },
-            'default_threshold': {
-                'threshold': 65.0,
-                'accuracy': round(accuracy_default * 100, 2),
-                'precision': round(precision_default * 100, 2),
-                'recall': round(recall_default * 100, 2),
-                'tar': round(tar_def * 100, 2),
-                'far': round(far_def * 100, 2),
-                'tp': tp_def, 'fp': fp_def, 'tn': tn_def, 'fn': fn_def
-            }
+            'positive_pairs': int(curve.positives),
+            'negative_pairs': int(curve.negatives),
+            'auc': round(curve.auc(), 4),
+            'eer': {'eer': round(eer * 100, 2), 'threshold': round(eer_threshold * 100, 2)},
+            'tar_at_far': tar_at_far,
+            'optimal_threshold': at_threshold(curve.youden()),
+            # Default API threshold (65%)
+            'default_threshold': at_threshold(0.65)
         }
         
+        if len(y_true) >= self.folds:
+            kfold = kfold_accuracy(y_true, y_scores, self.folds)
+            results['kfold'] = {
+                'folds': kfold['folds'],
+                'accuracy': round(kfold['accuracy_mean'] * 100, 2),
+                'std': round(kfold['accuracy_std'] * 100, 2),
+                'thresholds': [round(t * 100, 2) for t in kfold['thresholds']]
+            }
+        
+        if self.bootstrap_rounds:
+            intervals = bootstrap_intervals(y_true, y_scores, self.bootstrap_rounds, fars=self.fars)
+            results['confidence_intervals'] = {'confidence': 0.95, 'rounds': self.bootstrap_rounds}
+            for name, (low, high) in intervals.items():
+                # AUC stays a fraction like results['auc'], the rest are percentages
+                scale, digits = (1, 4) if name == 'auc' else (100, 2)
+                results['confidence_intervals'][name] = [round(low * scale, digits), round(high * scale, digits)]
+        
         return results
     
     def print_results(self, results):
@@ -232,6 +274,20 @@ class FaceVerificationEvaluator:
         print(f"Evaluated Pairs:   {results['evaluated_pairs']}")
         print(f"Failed Pairs:      {results['failed_pairs']}")
         print(f"AUC:               {results['auc']}")
+        print(f"EER:               {results['eer']['eer']}% (threshold {results['eer']['threshold']}%)")
+        for far, point in results['tar_at_far'].items():
+            # FAR below 1 / negatives cannot be measured
+            note = " (too few negative pairs)" if float(far) * results['negative_pairs'] < 1 else ""
+            print(f"TAR @ FAR={far:6s}: {point['tar']}%{note}")
+        if 'kfold' in results:
+            kfold = results['kfold']
+            print(f"{kfold['folds']}-fold accuracy:  {kfold['accuracy']}% ± {kfold['std']}%")
+        if 'confidence_intervals' in results:
+            intervals = results['confidence_intervals']
+            print(f"\n--- {intervals['confidence']:.0%} Confidence Intervals ({intervals['rounds']} bootstrap rounds) ---")
+            for name, bounds in intervals.items():
+                if isinstance(bounds, list):
+                    print(f"{name + ':':19s}{bounds[0]} - {bounds[1]}")
         
         print(f"\n--- With Optimal Threshold ({results['optimal_threshold']['threshold']}%) ---")
         print(f"Accuracy:          {results['optimal_threshold']['accuracy']}%")
@@ -254,7 +310,35 @@ class FaceVerificationEvaluator:
             json.dump(all_results, f, indent=4)
         print(f"\n✅ Results saved to {output_file}")
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Evaluate face verification on CALFW / CPLFW")
+    parser.add_argument('--offline', action='store_true', help="Run the models in-process instead of calling the API")
+    parser.add_argument('--name', help="Evaluate one dataset under this name (with --pairs-file and --images-dir)")
+    parser.add_argument('--pairs-file', help="Pairs file of the dataset given by --name")
+    parser.add_argument('--images-dir', help="Image directory of the dataset given by --name")
+    parser.add_argument('--max-pairs', type=int, default=0, help="Balanced sample of pairs (0 = all)")
+    parser.add_argument('--concurrency', type=int, default=8, help="Requests in flight (API mode)")
+    parser.add_argument('--model', help="Model pack (offline mode, default FACE_MODEL_NAME)")
+    parser.add_argument('--profile', help="Pipeline profile (default: the server's, fast offline)")
+    parser.add_argument('--aligned', action='store_true', help="Images are aligned crops: skip detection (offline mode)")
+    parser.add_argument('--batch-size', type=int, default=32, help="Recognition batch size (offline mode)")
+    parser.add_argument('--cache-dir', default='evaluation/embeddings', help="Embedding store directory (offline mode)")
+    parser.add_argument('--no-cache', action='store_true', help="Recompute every embedding (offline mode)")
+    parser.add_argument('--folds', type=int, default=10, help="Folds of the k-fold accuracy protocol")
+    parser.add_argument('--bootstrap', type=int, default=1000, help="Bootstrap rounds for confidence intervals (0 = off)")
+    parser.add_argument('--checkpoint-dir', default='evaluation/checkpoints', help="Per-dataset JSONL score checkpoints (API mode)")
+    checkpoint_mode = parser.add_mutually_exclusive_group()
+    checkpoint_mode.add_argument('--resume', action='store_true', help="Skip pairs already scored in the checkpoint (API mode)")
+    checkpoint_mode.add_argument('--fresh', action='store_true', help="Overwrite an existing checkpoint (API mode)")
+    parser.add_argument('--output', default='evaluation/results_all.json')
+    args = parser.parse_args()
+    if args.name and not (args.pairs_file and args.images_dir):
+        parser.error("--name needs --pairs-file and --images-dir")
+    return args
+
 def main():
+    args = parse_args()
+    
     # Dataset configurations
     DATASETS = {
         'CALFW': {
@@ -266,26 +350,39 @@ def main():
             'images_dir': r'C:\Users\reza.hatami\Desktop\datasets\cplfw\aligned images'
         }
     }
+    if args.name:
+        DATASETS = {args.name: {'pairs_file': args.pairs_file, 'images_dir': args.images_dir}}
     
     print("="*60)
     print("🎯 Face Verification Model - Multi-Dataset Evaluation")
     print("="*60)
     
-    # Check if server is running
-    try:
-        response = requests.get("http://localhost:8000")
-        if response.status_code != 200:
-            print("❌ Server is not running! Start server first:")
+    engine = None
+    if args.offline:
+        from offline_engine import OfflineEngine
+        print("📁 Loading models in-process (offline mode)")
+        cache_dir = None if args.no_cache else args.cache_dir
+        engine = OfflineEngine(args.model, args.profile or 'fast', args.aligned, args.batch_size, cache_dir=cache_dir)
+        if engine.store is not None:
+            print(f"💾 Embedding store: {engine.store.directory} ({len(engine.store)} images)")
+    else:
+        # Check if server is running
+        try:
+            response = requests.get("http://localhost:8000")
+            if response.status_code != 200:
+                print("❌ Server is not running! Start server first:")
+                print("   python server.py")
+                return
+            print("✅ Server is running")
+        except:
+            print("❌ Cannot connect to server! Start server first:")
             print("   python server.py")
             return
-        print("✅ Server is running")
-    except:
-        print("❌ Cannot connect to server! Start server first:")
-        print("   python server.py")
-        return
     
     # Initialize evaluator
-    evaluator = FaceVerificationEvaluator()
+    evaluator = FaceVerificationEvaluator(concurrency=args.concurrency, folds=args.folds, bootstrap_rounds=args.bootstrap,
+                                          checkpoint_dir=args.checkpoint_dir, resume=args.resume, fresh=args.fresh,
+                                          profile=args.profile)
     all_results = {}
     
     # Evaluate each dataset
@@ -299,21 +396,33 @@ def main():
             print(f"\n⚠️  {dataset_name} images directory not found: {config['images_dir']}")
             continue
         
-        # Run evaluation (remove max_pairs for full evaluation)
-        results = evaluator.evaluate_dataset(
-            dataset_name,
-            config['pairs_file'],
-            config['images_dir'],
-            max_pairs=None  # Full evaluation
-        )
+        # Run evaluation (all pairs unless --max-pairs is set)
+        if engine is not None:
+            results = evaluator.evaluate_dataset_offline(
+                dataset_name,
+                config['pairs_file'],
+                config['images_dir'],
+                engine,
+                max_pairs=args.max_pairs or None
+            )
+        else:
+            results = evaluator.evaluate_dataset(
+                dataset_name,
+                config['pairs_file'],
+                config['images_dir'],
+                max_pairs=args.max_pairs or None
+            )
         
         if results:
             evaluator.print_results(results)
             all_results[dataset_name] = results
     
+    if engine is not None:
+        engine.shutdown()
+    
     # Save all results
     if all_results:
-        evaluator.save_results(all_results)
+        evaluator.save_results(all_results, args.output)
         
         print("\n" + "="*60)
         print("🎉 Evaluation Complete!")
@@ -322,7 +431,7 @@ def main():
         for dataset_name, results in all_results.items():
             opt_acc = results['optimal_threshold']['accuracy']
             def_acc = results['default_threshold']['accuracy']
-            print(f"{dataset_name:10s} - Optimal: {opt_acc}% | Default: {def_acc}% | AUC: {results['auc']}")
+            print(f"{dataset_name:10s} - Optimal: {opt_acc}% | Default: {def_acc}% | AUC: {results['auc']} | EER: {results['eer']['eer']}%")
     else:
         print("\n❌ No datasets were evaluated successfully")
 
@@ -4,12 +4,14 @@ import json
 from sklearn.metrics import accuracy_score, precision_score, recall_score, roc_auc_score
 import numpy as np
 from tqdm import tqdm
+from api_client import VerificationClient
 
 class LFWEvaluator:
     """Evaluate face verification model on LFW dataset"""
     
-    def __init__(self, api_url="http://localhost:8000/verify_faces"):
+    def __init__(self, api_url="http://localhost:8000/verify_faces", concurrency=8):
         self.api_url = api_url
+        self.client = VerificationClient(api_url, concurrency=concurrency)
         self.results = []
         
     def load_lfw_pairs(self, pairs_file):
@@ -51,25 +53,7 @@ class LFWEvaluator:
     
     def verify_pair(self, img1_path, img2_path):
         """Send pair to API and get similarity score"""
-        try:
-            with open(img1_path, 'rb') as f1, open(img2_path, 'rb') as f2:
-                files = {
-                    'image1': ('img1.jpg', f1, 'image/jpeg'),
-                    'image2': ('img2.jpg', f2, 'image/jpeg')
-                }
-                
-                response = requests.post(self.api_url, files=files, timeout=30)
-                
-                if response.status_code == 200:
-                    result = response.json()
-                    return result['similarity_score']
-                else:
-                    print(f"Error: {response.status_code}")
-                    return None
-                    
-        except Exception as e:
-            print(f"Error processing pair: {e}")
-            return None
+        return self.client.verify_pair(img1_path, img2_path)
     
     def evaluate(self, lfw_dir, pairs_file, max_pairs=None):
         """Run evaluation on LFW dataset"""
@@ -85,7 +69,9 @@ class LFWEvaluator:
         y_scores = []
         y_pred = []
         
-        for pair in tqdm(pairs, desc="Processing"):
+        valid_pairs = []
+        path_pairs = []
+        for pair in pairs:
             img1_path = self.get_image_path(lfw_dir, pair['person1'], pair['img1'])
             img2_path = self.get_image_path(lfw_dir, pair['person2'], pair['img2'])
             
@@ -94,9 +80,12 @@ class LFWEvaluator:
                 print(f"⚠️  Missing images: {img1_path} or {img2_path}")
                 continue
             
-            # Get similarity score
-            score = self.verify_pair(img1_path, img2_path)
-            
+            valid_pairs.append(pair)
+            path_pairs.append((img1_path, img2_path))
+        
+        # Get similarity scores (concurrent requests, results in pair order)
+        scores = self.client.verify_pairs(path_pairs)
+        for pair, score in tqdm(zip(valid_pairs, scores), total=len(valid_pairs), desc="Processing"):
             if score is not None:
                 y_true.append(pair['label'])
                 y_scores.append(score / 100.0)  # Normalize to [0,1]
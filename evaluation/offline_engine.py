@@ -0,0 +1,164 @@
+"""
+Offline evaluation engine
+Runs the server's pipeline in-process: every unique image of a dataset is
+decoded, detected and aligned once on a pool of detection replicas, embedded
+in recognition batches, and all pairs are scored with one vectorized cosine
+computation over the embedding matrix. No HTTP server is involved.
+With a cache directory, embeddings persist in an EmbeddingStore and only new
+or changed images are embedded on later runs.
+"""
+
+import os
+import sys
+from collections import deque
+from functools import partial
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+class OfflineEngine:
+    """Embeds dataset images with the same models and preprocessing as the API
+
+    aligned=True treats every image as an aligned face crop (no detection),
+    like the API's ?aligned=true.
+    """
+
+    def __init__(self, model_name=None, profile='fast', aligned=False, batch_size=32, workers=None, cache_dir=None):
+        import config
+        from face_models import build_face_model, build_recognition_model
+        from model_pool import ModelPool
+
+        self.model_name = model_name or config.MODEL_NAME
+        self.profile = profile
+        self.aligned = aligned
+        self.batch_size = batch_size
+        workers = workers or config.NUM_WORKERS
+        self.rec_model = build_recognition_model(model_name)
+        self.crop_size = self.rec_model.input_size[0]
+        if aligned:
+            # Decoding only: the pool's "replicas" are never used
+            self.pool = ModelPool(lambda: None, workers)
+        else:
+            self.pool = ModelPool(partial(build_face_model, workers, profile, model_name), workers)
+
+        self.store = None
+        if cache_dir:
+            from embedding_store import EmbeddingStore
+            self.store = EmbeddingStore(cache_dir, self.settings())
+
+    def settings(self):
+        """Everything that changes the embeddings: model files and preprocessing"""
+        import config
+        from face_models import models_root
+
+        model_dir = Path(models_root()).expanduser() / 'models' / self.model_name
+        files = sorted(
+            (f.name, f.stat().st_size, f.stat().st_mtime_ns)
+            for f in model_dir.glob('*.onnx')
+        ) if model_dir.is_dir() else []
+        return {
+            'model': self.model_name,
+            'model_files': files,
+            'profile': self.profile,
+            'aligned': self.aligned,
+            'det_sizes': config.DET_SIZES,
+            'decode_min_side': config.DECODE_MIN_SIDE,
+            'max_image_pixels': config.MAX_IMAGE_PIXELS
+        }
+
+    def _crop(self, face_model, path):
+        """Aligned crop of one image file, or None if it has no usable face"""
+        import server
+
+        try:
+            image_bytes = Path(path).read_bytes()
+            if self.aligned:
+                return server.prepare_aligned_face(image_bytes, self.crop_size)
+            return server.detect_face(face_model, image_bytes, path, self.crop_size)
+        except (OSError, server.HTTPException):
+            return None
+
+    def _crops(self, paths):
+        """Crop per path in order; detection runs ahead on the replica pool"""
+        window = deque()
+        for path in paths:
+            window.append(self.pool.submit(self._crop, path))
+            if len(window) >= 4 * self.batch_size:
+                yield window.popleft().result()
+        while window:
+            yield window.popleft().result()
+
+    def embed(self, paths, progress=None):
+        """(embeddings, valid): one unit-length row per path, zeros where no face was found"""
+        if self.store is None:
+            return self._embed(paths, progress)
+
+        embeddings, valid, missing = self.store.get(paths)
+        if progress is not None:
+            progress.update(len(paths) - len(missing))
+        if not missing:
+            return embeddings, valid
+
+        computed, computed_valid = self._embed([paths[i] for i in missing], progress)
+        self.store.put([paths[i] for i in missing], computed, computed_valid)
+        if embeddings.shape[1] < computed.shape[1]:
+            # Nothing was cached with a face yet
+            embeddings = np.zeros((len(paths), computed.shape[1]), dtype=np.float32)
+        embeddings[missing] = computed
+        valid[missing] = computed_valid
+        return embeddings, valid
+
+    def _embed(self, paths, progress=None):
+        """Embed paths from scratch"""
+        embeddings = None
+        valid = np.zeros(len(paths), dtype=bool)
+        batch, rows = [], []
+
+        def flush():
+            nonlocal embeddings
+            features = self.rec_model.get_feat(batch)
+            if embeddings is None:
+                embeddings = np.zeros((len(paths), features.shape[1]), dtype=np.float32)
+            embeddings[rows] = features / np.linalg.norm(features, axis=1, keepdims=True)
+            valid[rows] = True
+            batch.clear()
+            rows.clear()
+
+        for row, crop in enumerate(self._crops(paths)):
+            if crop is not None:
+                batch.append(crop)
+                rows.append(row)
+                if len(batch) >= self.batch_size:
+                    flush()
+            if progress is not None:
+                progress.update(1)
+        if batch:
+            flush()
+        if embeddings is None:
+            embeddings = np.zeros((len(paths), 1), dtype=np.float32)
+        return embeddings, valid
+
+    def score_pairs(self, pairs, images_dir, progress=None):
+        """(y_true, y_scores in [0,1], failed) for pairs of {'img1', 'img2', 'label'}
+
+        Each image is embedded once however many pairs it appears in.
+        """
+        names = sorted({name for pair in pairs for name in (pair['img1'], pair['img2'])})
+        index = {name: i for i, name in enumerate(names)}
+        embeddings, valid = self.embed([os.path.join(images_dir, name) for name in names], progress)
+
+        left = np.array([index[pair['img1']] for pair in pairs], dtype=np.int64)
+        right = np.array([index[pair['img2']] for pair in pairs], dtype=np.int64)
+        scored = valid[left] & valid[right]
+        similarities = np.einsum('ij,ij->i', embeddings[left[scored]], embeddings[right[scored]])
+
+        labels = np.array([pair['label'] for pair in pairs])[scored]
+        # Same scale as the API's similarity_score / 100
+        scores = (similarities + 1) / 2
+        return labels.tolist(), scores.tolist(), int(len(pairs) - scored.sum())
+
+    def shutdown(self):
+        self.pool.shutdown()
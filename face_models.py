@@ -0,0 +1,327 @@
+"""
+InsightFace model loading
+Builds FaceAnalysis instances whose ONNX sessions can be tuned per replica
+"""
+
+import glob
+import hashlib
+import os
+import platform
+from pathlib import Path
+
+import numpy as np
+import onnx
+import onnxruntime
+from insightface.app import FaceAnalysis
+from insightface.app.common import Face
+from insightface.model_zoo.model_zoo import ArcFaceONNX, Attribute, Landmark, RetinaFace
+from insightface.utils import ensure_available, face_align
+
+import config
+
+GRAPH_OPTIMIZATION_LEVELS = {
+    'disable': onnxruntime.GraphOptimizationLevel.ORT_DISABLE_ALL,
+    'basic': onnxruntime.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    'extended': onnxruntime.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    'all': onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL,
+}
+
+EXECUTION_MODES = {
+    'sequential': onnxruntime.ExecutionMode.ORT_SEQUENTIAL,
+    'parallel': onnxruntime.ExecutionMode.ORT_PARALLEL,
+}
+
+# Named pipeline profiles: the insightface modules each one loads and runs.
+# Verification only needs the detector (box + 5 keypoints for alignment) and
+# the recognition embedding; 'full' also runs the 2d106/3d68 landmark and
+# genderage models on every face.
+PIPELINE_PROFILES = {
+    'fast': ('detection', 'recognition'),
+    'full': None,
+}
+
+
+def create_session_options(intra_op_threads, optimization=None):
+    """Session options from the FACE_ORT_* settings
+
+    optimization overrides the configured graph optimization level (used to
+    skip optimization when loading an already optimized graph).
+    """
+    optimization = optimization or config.ORT_GRAPH_OPTIMIZATION
+    if optimization not in GRAPH_OPTIMIZATION_LEVELS:
+        raise ValueError(f"Unknown graph optimization '{optimization}', expected one of {list(GRAPH_OPTIMIZATION_LEVELS)}")
+    if config.ORT_EXECUTION_MODE not in EXECUTION_MODES:
+        raise ValueError(f"Unknown execution mode '{config.ORT_EXECUTION_MODE}', expected one of {list(EXECUTION_MODES)}")
+
+    options = onnxruntime.SessionOptions()
+    options.intra_op_num_threads = intra_op_threads
+    options.inter_op_num_threads = config.ORT_INTER_OP_THREADS
+    options.execution_mode = EXECUTION_MODES[config.ORT_EXECUTION_MODE]
+    options.graph_optimization_level = GRAPH_OPTIMIZATION_LEVELS[optimization]
+    if not config.ORT_ALLOW_SPINNING:
+        # Idle intra-op threads sleep instead of busy-waiting for work
+        options.add_session_config_entry('session.intra_op.allow_spinning', '0')
+    return options
+
+
+_cpu_signature = None
+
+
+def cpu_signature():
+    """Architecture, CPU model and instruction set flags of this machine
+
+    Read from /proc/cpuinfo where available (flags on x86, Features on ARM);
+    elsewhere falls back to what the platform module reports.
+    """
+    global _cpu_signature
+    if _cpu_signature is None:
+        fields = {}
+        try:
+            with open('/proc/cpuinfo') as f:
+                for line in f:
+                    name, _, value = line.partition(':')
+                    name = name.strip()
+                    if name in ('model name', 'flags', 'Features', 'CPU part') and name not in fields:
+                        fields[name] = ' '.join(sorted(value.split()))
+        except OSError:
+            pass
+        fields.setdefault('processor', platform.processor())
+        _cpu_signature = '|'.join([platform.machine()] + [f"{k}={v}" for k, v in sorted(fields.items())])
+    return _cpu_signature
+
+
+def optimized_model_path(onnx_file):
+    """Cache file for a model's optimized graph under the current settings
+
+    At 'all', ONNX Runtime applies layout transforms that depend on the
+    instruction sets available (e.g. NCHWc block size for AVX2 vs AVX-512),
+    so the key covers the source file, ONNX Runtime version, level,
+    providers and the CPU model and feature flags.
+    """
+    stat = os.stat(onnx_file)
+    key = '|'.join(map(str, [
+        os.path.abspath(onnx_file), stat.st_size, stat.st_mtime_ns,
+        onnxruntime.__version__, config.ORT_GRAPH_OPTIMIZATION,
+        ','.join(config.ORT_PROVIDERS), cpu_signature()
+    ]))
+    digest = hashlib.blake2b(key.encode(), digest_size=8).hexdigest()
+    return os.path.join(config.ORT_CACHE_DIR, f"{Path(onnx_file).stem}-{digest}.onnx")
+
+
+def create_session(onnx_file, intra_op_threads):
+    """InferenceSession for a model, reusing its cached optimized graph
+
+    The first load optimizes the graph as usual and serializes the result;
+    later loads read that file with optimization disabled.
+    """
+    providers = config.ORT_PROVIDERS
+    if not config.ORT_CACHE_DIR or config.ORT_GRAPH_OPTIMIZATION == 'disable':
+        return onnxruntime.InferenceSession(
+            onnx_file, sess_options=create_session_options(intra_op_threads), providers=providers
+        )
+
+    cached = optimized_model_path(onnx_file)
+    if os.path.exists(cached):
+        try:
+            return onnxruntime.InferenceSession(
+                cached, sess_options=create_session_options(intra_op_threads, 'disable'), providers=providers
+            )
+        except Exception as e:
+            print(f"⚠️  Ignoring unreadable optimized model {cached}: {e}")
+
+    # Write to a private file first so concurrent loaders never read a partial graph
+    os.makedirs(config.ORT_CACHE_DIR, exist_ok=True)
+    tmp_path = f"{cached[:-len('.onnx')]}.{os.getpid()}.tmp.onnx"
+    options = create_session_options(intra_op_threads)
+    options.optimized_model_filepath = tmp_path
+    session = onnxruntime.InferenceSession(onnx_file, sess_options=options, providers=providers)
+    if os.path.exists(tmp_path):
+        os.replace(tmp_path, cached)
+    return session
+
+
+def route_model(onnx_file, session):
+    """insightface's ModelRouter dispatch for an existing session
+
+    The wrappers inspect their graph through model_file, so they always get
+    the original file even when the session runs the optimized graph.
+    """
+    inputs = session.get_inputs()
+    input_shape = inputs[0].shape
+    if len(session.get_outputs()) >= 5:
+        return RetinaFace(model_file=onnx_file, session=session)
+    if input_shape[2] == 192 and input_shape[3] == 192:
+        return Landmark(model_file=onnx_file, session=session)
+    if input_shape[2] == 96 and input_shape[3] == 96:
+        return Attribute(model_file=onnx_file, session=session)
+    if len(inputs) == 1 and input_shape[2] == input_shape[3] and input_shape[2] >= 112 and input_shape[2] % 16 == 0:
+        return ArcFaceONNX(model_file=onnx_file, session=session)
+    return None
+
+
+def model_task(onnx_file):
+    """Task a model file would be routed to, read from its graph signature
+
+    Mirrors route_model without creating a session, so models a profile
+    leaves out are never optimized, cached or loaded into ONNX Runtime.
+    """
+    graph = onnx.load(onnx_file, load_external_data=False).graph
+    initializers = {tensor.name for tensor in graph.initializer}
+    inputs = [value for value in graph.input if value.name not in initializers]
+
+    def shape(value):
+        return [d.dim_value if d.HasField('dim_value') else None for d in value.type.tensor_type.shape.dim]
+
+    input_shape = shape(inputs[0])
+    if len(graph.output) >= 5:
+        return 'detection'
+    if input_shape[2] == 192 and input_shape[3] == 192:
+        points = shape(graph.output[0])[1]
+        return 'landmark_3d_68' if points == 3309 else f'landmark_2d_{points // 2}'
+    if input_shape[2] == 96 and input_shape[3] == 96:
+        return 'genderage'
+    if (len(inputs) == 1 and input_shape[2] is not None and input_shape[2] == input_shape[3]
+            and input_shape[2] >= 112 and input_shape[2] % 16 == 0):
+        return 'recognition'
+    return None
+
+
+class TunedFaceAnalysis(FaceAnalysis):
+    """FaceAnalysis whose ONNX Runtime sessions follow the FACE_ORT_* settings
+
+    insightface's own constructor only passes providers through to
+    onnxruntime, so the model pack is loaded here with the same routing logic.
+    """
+
+    def __init__(self, name, root, allowed_modules=None, exclude_modules=(), intra_op_threads=1):
+        onnxruntime.set_default_logger_severity(3)
+        self.models = {}
+        self.model_dir = ensure_available('models', name, root=root)
+        for onnx_file in sorted(glob.glob(os.path.join(self.model_dir, '*.onnx'))):
+            # Filter before building sessions: unused models cost no load time or memory
+            taskname = model_task(onnx_file)
+            if taskname is None:
+                print(f"⚠️  Model not recognized: {onnx_file}")
+            elif allowed_modules is not None and taskname not in allowed_modules:
+                continue
+            elif taskname in exclude_modules:
+                continue
+            elif taskname in self.models:
+                print(f"⚠️  Duplicated model task {taskname}, ignoring: {onnx_file}")
+            else:
+                model = route_model(onnx_file, create_session(onnx_file, intra_op_threads))
+                self.models[model.taskname] = model
+        self.det_model = self.models.get('detection')
+        self.det_sizes = []
+        self.fixed_det_size = False
+
+    def prepare_det_sizes(self, det_sizes, det_thresh=0.5):
+        """Prepare the detector for several square input sizes
+
+        A detector exported with a static input shape only supports that one
+        size. Each size is run once on a blank image so its anchor grid is
+        cached; warm_up() then exercises the sessions themselves.
+        """
+        static_size = self.det_model.input_size
+        self.fixed_det_size = static_size is not None
+        self.det_sizes = [static_size[0]] if self.fixed_det_size else sorted(det_sizes)
+        largest = self.det_sizes[-1]
+        self.prepare(ctx_id=0, det_thresh=det_thresh, det_size=(largest, largest))
+        blank = np.zeros((largest, largest, 3), dtype=np.uint8)
+        for size in self.det_sizes:
+            self.det_model.detect(blank, input_size=None if self.fixed_det_size else (size, size))
+
+    def warm_up(self, rounds=1):
+        """Run every prepared detector size and every face model on synthetic input
+
+        ONNX Runtime allocates buffers and picks kernels during the first runs
+        of each input shape; doing that here keeps it out of the first requests.
+        """
+        largest = self.det_sizes[-1]
+        img = np.random.default_rng(0).integers(0, 256, (largest, largest, 3), dtype=np.uint8)
+        # A face filling the middle half of the image, keypoints in the ArcFace template layout
+        scale = largest / 2 / 112
+        face = Face(
+            bbox=np.array([largest / 4, largest / 4, largest * 3 / 4, largest * 3 / 4], dtype=np.float32),
+            kps=face_align.arcface_dst * scale + largest / 4,
+            det_score=1.0
+        )
+        for _ in range(rounds):
+            for size in self.det_sizes:
+                input_size = None if self.fixed_det_size else (size, size)
+                self.det_model.detect(img, input_size=input_size, max_num=0, metric='default')
+            for taskname, model in self.models.items():
+                if taskname != 'detection':
+                    model.get(img, face)
+
+    def select_det_size(self, height, width):
+        """Smallest prepared size covering the longer side, else the largest
+
+        Small images are not upscaled to a large detector input, which costs
+        time without making faces easier to find.
+        """
+        longest = max(height, width)
+        for size in self.det_sizes:
+            if size >= longest:
+                return size
+        return self.det_sizes[-1]
+
+    def get(self, img, max_num=0, det_size=None):
+        """Detect faces at det_size (chosen from the image size when None)"""
+        if det_size is None:
+            det_size = self.select_det_size(*img.shape[:2])
+        input_size = None if self.fixed_det_size else (det_size, det_size)
+        bboxes, kpss = self.det_model.detect(img, input_size=input_size, max_num=max_num, metric='default')
+
+        faces = []
+        for i in range(bboxes.shape[0]):
+            face = Face(bbox=bboxes[i, 0:4], kps=kpss[i] if kpss is not None else None, det_score=bboxes[i, 4])
+            for taskname, model in self.models.items():
+                if taskname != 'detection':
+                    model.get(img, face)
+            faces.append(face)
+        return faces
+
+
+def models_root():
+    """Local models directory, or insightface's default download location"""
+    if config.MODELS_DIR.exists():
+        return str(config.MODELS_DIR)
+    return '~/.insightface'
+
+
+def build_face_model(num_replicas=1, profile='fast', model_name=None):
+    """Create and prepare one detection replica for a pipeline profile
+
+    Recognition is excluded: embeddings are computed by the shared
+    RecognitionBatcher. Each replica gets cores / num_replicas intra-op
+    threads so that a full pool does not oversubscribe the CPU.
+    """
+    if profile not in PIPELINE_PROFILES:
+        raise ValueError(f"Unknown pipeline profile '{profile}', expected one of {list(PIPELINE_PROFILES)}")
+    intra_op_threads = config.ORT_INTRA_OP_THREADS or max(1, config.CPU_COUNT // num_replicas)
+
+    face_model = TunedFaceAnalysis(
+        name=model_name or config.MODEL_NAME,
+        root=models_root(),
+        allowed_modules=PIPELINE_PROFILES[profile],
+        exclude_modules=('recognition',),
+        intra_op_threads=intra_op_threads
+    )
+    assert face_model.det_model is not None, f"No detection model in {face_model.model_dir}"
+    face_model.prepare_det_sizes(config.DET_SIZES)
+    return face_model
+
+
+def build_recognition_model(model_name=None):
+    """Load the ArcFace recognition model used for batched embedding"""
+    face_model = TunedFaceAnalysis(
+        name=model_name or config.MODEL_NAME,
+        root=models_root(),
+        allowed_modules=('recognition',),
+        intra_op_threads=config.ORT_INTRA_OP_THREADS or config.CPU_COUNT
+    )
+    rec_model = face_model.models.get('recognition')
+    assert rec_model is not None, f"No recognition model in {face_model.model_dir}"
+    rec_model.prepare(ctx_id=0)
+    return rec_model
@@ -0,0 +1,259 @@
+"""
+Prometheus metrics
+Counters, gauges and latency histograms for every stage of the request path,
+rendered in the Prometheus text format by GET /metrics
+
+Observing a value is a dict lookup, a bisect and a locked increment, so the
+instrumentation stays on in production. The same stage timings are sent
+back to the client of each request in a Server-Timing header.
+"""
+
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+# Latency buckets in seconds, from sub-millisecond decodes to slow batches
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Prometheus text exposition format (the response adds charset=utf-8)
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+
+def format_labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join(f'{name}="{escape(value)}"' for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """Base for metrics with a fixed set of label names"""
+
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(Metric):
+    """Monotonic count per label set"""
+
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        return self.header() + [
+            f"{self.name}{format_labels(self.labelnames, labels)} {format_value(value)}" for labels, value in values
+        ]
+
+
+class Histogram(Metric):
+    """Cumulative-bucket histogram per label set"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # labels -> [per-bucket counts (last = +Inf), sum]
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    @contextmanager
+    def time(self, *labels):
+        """Observe the duration of the with-block"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def render(self):
+        with self._lock:
+            series = sorted((labels, (list(counts), total)) for labels, (counts, total) in self._series.items())
+        lines = self.header()
+        names = self.labelnames + ('le',)
+        for labels, (counts, total) in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{format_labels(names, labels + (format_value(bound),))} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(self.labelnames, labels)} {format_value(total)}")
+            lines.append(f"{self.name}_count{format_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+class CallbackMetric(Metric):
+    """Gauge or counter read from existing state at scrape time
+
+    callback() returns a number, or a dict of label tuples to numbers.
+    """
+
+    def __init__(self, name, documentation, kind, callback, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self.kind = kind
+        self.callback = callback
+
+    def render(self):
+        values = self.callback()
+        if not isinstance(values, dict):
+            values = {(): values}
+        return self.header() + [
+            f"{self.name}{format_labels(self.labelnames, labels)} {format_value(value)}"
+            for labels, value in sorted(values.items())
+        ]
+
+
+class Registry:
+    """Ordered collection of metrics rendered together"""
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines += metric.render()
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+REQUESTS = REGISTRY.register(Counter(
+    "face_http_requests_total", "HTTP requests by route, method and status code", ("route", "method", "status")
+))
+REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "face_http_request_duration_seconds", "HTTP request latency by route", ("route",)
+))
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "face_stage_duration_seconds", "Latency of each stage of the request path", ("stage",)
+))
+FACES_DETECTED = REGISTRY.register(Counter(
+    "face_faces_detected_total", "Faces found by the detector"
+))
+NO_FACE = REGISTRY.register(Counter(
+    "face_no_face_total", "Images rejected with 400 because no face was detected"
+))
+
+# (stage, seconds) pairs of the current request, for its Server-Timing header.
+# A list because stages of one request run on several threads; append is atomic.
+request_timings = contextvars.ContextVar('request_timings', default=None)
+
+
+@contextmanager
+def stage(name):
+    """Time one stage of the request path (read, decode, detect, ...)"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, name)
+        timings = request_timings.get()
+        if timings is not None:
+            timings.append((name, elapsed))
+
+
+def server_timing(timings, total):
+    """Server-Timing header value in milliseconds, stages in first-seen order
+
+    Stages that ran more than once (one per image) are summed.
+    """
+    durations = {}
+    for name, seconds in timings:
+        durations[name] = durations.get(name, 0.0) + seconds
+    durations['total'] = total
+    return ', '.join(f"{name};dur={seconds * 1000:.2f}" for name, seconds in durations.items())
+
+
+class MetricsMiddleware:
+    """ASGI middleware counting requests and timing them by route template
+
+    Routes are labelled with their path template (/verify/{template_id}) so
+    template ids do not create new series; unmatched paths share one label.
+    Time spent waiting for the request body is the 'receive' stage. Every
+    response carries the stages of its request in a Server-Timing header.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        start = time.perf_counter()
+        receive_seconds = 0.0
+        has_body = False
+        timings = []
+        token = request_timings.set(timings)
+
+        async def receive_wrapper():
+            nonlocal receive_seconds, has_body
+            t0 = time.perf_counter()
+            message = await receive()
+            if message['type'] == 'http.request':
+                receive_seconds += time.perf_counter() - t0
+                has_body = has_body or bool(message.get('body'))
+            return message
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+                if has_body:
+                    timings.insert(0, ('receive', receive_seconds))
+                header = server_timing(timings, time.perf_counter() - start)
+                message['headers'] = list(message.get('headers', [])) + [(b'server-timing', header.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive_wrapper, send_wrapper)
+        finally:
+            request_timings.reset(token)
+            if has_body:
+                STAGE_SECONDS.observe(receive_seconds, 'receive')
+            route = scope.get('route')
+            path = getattr(route, 'path', None) or 'unmatched'
+            REQUESTS.inc(path, scope['method'], str(status))
+            REQUEST_SECONDS.observe(time.perf_counter() - start, path)
@@ -0,0 +1,76 @@
+"""
+Pool of face model replicas
+Inference runs on worker threads so the event loop only handles I/O
+"""
+
+import asyncio
+import contextvars
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+
+class ModelPool:
+    """Fixed set of model replicas, each used by one worker thread at a time
+
+    ONNX Runtime releases the GIL while a session runs, so replicas on
+    separate threads execute in parallel across cores.
+    """
+
+    def __init__(self, factory, size):
+        self.size = size
+        self._replicas = queue.Queue()
+        for _ in range(size):
+            self._replicas.put(factory())
+        self._executor = ThreadPoolExecutor(
+            max_workers=size,
+            thread_name_prefix="face-worker"
+        )
+        self.waiting = 0  # jobs submitted but not yet running on a replica
+        self._waiting_lock = threading.Lock()
+
+    def _call(self, submitted, fn, *args):
+        replica = self._replicas.get()
+        with self._waiting_lock:
+            self.waiting -= 1
+        metrics.STAGE_SECONDS.observe(time.perf_counter() - submitted, "replica_wait")
+        try:
+            return fn(replica, *args)
+        finally:
+            self._replicas.put(replica)
+
+    def for_each_replica(self, fn):
+        """Call fn(replica) on every replica in turn, holding all of them meanwhile"""
+        replicas = [self._replicas.get() for _ in range(self.size)]
+        try:
+            for replica in replicas:
+                fn(replica)
+        finally:
+            for replica in replicas:
+                self._replicas.put(replica)
+
+    def submit(self, fn, *args):
+        """Schedule fn(replica, *args) on a free replica; returns a Future"""
+        with self._waiting_lock:
+            self.waiting += 1
+        # Run in the caller's context so stage timings reach its request
+        context = contextvars.copy_context()
+        future = self._executor.submit(context.run, self._call, time.perf_counter(), fn, *args)
+        future.add_done_callback(self._discard_cancelled)
+        return future
+
+    def _discard_cancelled(self, future):
+        """A job cancelled before it started never reaches _call"""
+        if future.cancelled():
+            with self._waiting_lock:
+                self.waiting -= 1
+
+    async def run(self, fn, *args):
+        """Run fn(replica, *args) on a free replica without blocking the loop"""
+        return await asyncio.wrap_future(self.submit(fn, *args))
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
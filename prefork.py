@@ -0,0 +1,191 @@
+"""
+Pre-fork multi-process serving
+The master loads the models once, then forks workers that share the model
+weights copy-on-write and serve the same listening socket. Workers that exit
+are restarted. Extra services (the shared-memory inference process) are
+supervised the same way.
+
+ONNX Runtime thread pools do not survive fork(), so every session runs with
+one intra-op thread; parallelism comes from processes and replicas instead.
+Nothing that starts a thread (replica pools, the recognition batcher) may be
+created before the fork.
+"""
+
+import gc
+import os
+import signal
+import socket
+import time
+from functools import partial
+
+import uvicorn
+
+import config
+
+# Seconds after (re)starting workers before the memory report is printed
+MEMORY_REPORT_DELAY = 10.0
+
+# Workers that die sooner than this after starting are restarted with backoff
+MIN_WORKER_UPTIME = 5.0
+MAX_RESTART_DELAY = 30.0
+
+
+def process_memory(pid='self'):
+    """Memory of a process in MB from /proc/<pid>/smaps_rollup (None elsewhere)
+
+    private_mb is memory no other process shares: for a forked worker, its
+    real cost on top of the master's shared model weights.
+    """
+    fields = {}
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 2 and parts[0].endswith(':') and parts[1].isdigit():
+                    fields[parts[0][:-1]] = int(parts[1]) / 1024
+    except OSError:
+        return None
+    return {
+        'rss_mb': round(fields.get('Rss', 0), 1),
+        'pss_mb': round(fields.get('Pss', 0), 1),
+        'private_mb': round(fields.get('Private_Clean', 0) + fields.get('Private_Dirty', 0), 1),
+        'shared_mb': round(fields.get('Shared_Clean', 0) + fields.get('Shared_Dirty', 0), 1)
+    }
+
+
+def bind_socket(host, port):
+    """Listening socket created by the master and inherited by every worker"""
+    family = socket.AF_INET6 if ':' in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_api_worker(app, sock, index, worker_init=None):
+    """Child process: serve the inherited socket until told to stop"""
+    if worker_init is not None:
+        worker_init(index)
+    server = uvicorn.Server(uvicorn.Config(app, log_level="info"))
+    server.run(sockets=[sock])
+
+
+class Supervisor:
+    """Forks, watches and restarts child processes
+
+    targets is a list of (name, function); slot i always runs targets[i].
+    """
+
+    def __init__(self, targets):
+        self.targets = targets
+        self.workers = {}  # pid -> (slot, start time)
+        self.restart_delay = {}  # slot -> seconds to wait before the next restart
+        self.stopping = False
+        self.report_at = None
+
+    def spawn(self, slot):
+        pid = os.fork()
+        if pid == 0:
+            self._run_child(self.targets[slot][1])
+        self.workers[pid] = (slot, time.monotonic())
+        self.report_at = time.monotonic() + MEMORY_REPORT_DELAY
+        print(f"👷 {self.targets[slot][0]} started (pid {pid})")
+
+    def _run_child(self, target):
+        code = 0
+        try:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            target()
+        except BaseException as e:
+            print(f"❌ Process {os.getpid()} failed: {e}")
+            code = 1
+        finally:
+            os._exit(code)
+
+    def stop(self, signum, frame):
+        self.stopping = True
+        for pid in self.workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def report_memory(self):
+        """Print master and per-worker memory; private MB is each worker's increment"""
+        master = process_memory()
+        if master is None:
+            return
+        print(f"📊 Master (pid {os.getpid()}): {master['rss_mb']} MB RSS")
+        private = []
+        for pid, (slot, _) in sorted(self.workers.items(), key=lambda w: w[1][0]):
+            memory = process_memory(pid)
+            if memory is None:
+                continue
+            if self.targets[slot][0].startswith("Worker"):
+                private.append(memory['private_mb'])
+            print(f"   {self.targets[slot][0]} (pid {pid}): {memory['rss_mb']} MB RSS, {memory['pss_mb']} MB PSS, "
+                  f"{memory['private_mb']} MB private, {memory['shared_mb']} MB shared")
+        if private:
+            print(f"💡 Each extra API worker costs ~{sum(private) / len(private):.1f} MB of private memory")
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        for slot in range(len(self.targets)):
+            self.spawn(slot)
+
+        while self.workers:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if pid == 0:
+                time.sleep(0.2)
+                if self.report_at is not None and time.monotonic() >= self.report_at and not self.stopping:
+                    self.report_at = None
+                    self.report_memory()
+                continue
+
+            slot, started = self.workers.pop(pid)
+            if self.stopping:
+                continue
+            code = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+            print(f"⚠️  {self.targets[slot][0]} (pid {pid}) exited with status {code}, restarting")
+
+            # Back off when a worker keeps dying right after starting
+            if time.monotonic() - started < MIN_WORKER_UPTIME:
+                delay = min(MAX_RESTART_DELAY, 2 * self.restart_delay.get(slot, 0.5))
+                self.restart_delay[slot] = delay
+                time.sleep(delay)
+            else:
+                self.restart_delay.pop(slot, None)
+            if not self.stopping:
+                self.spawn(slot)
+        print("✅ All workers stopped")
+
+
+def serve(app, processes, preload=None, worker_init=None, services=None):
+    """Serve app from forked worker processes
+
+    preload() runs in the master before forking, so whatever it loads is
+    shared copy-on-write. worker_init(index) runs in each worker before
+    uvicorn starts. services maps names to functions run in their own
+    supervised processes.
+    """
+    if preload is not None:
+        if config.ORT_INTRA_OP_THREADS not in (0, 1) or config.ORT_EXECUTION_MODE != 'sequential':
+            print("⚠️  Pre-fork mode runs ONNX Runtime sequentially with 1 intra-op thread per session")
+        config.ORT_INTRA_OP_THREADS = 1
+        config.ORT_EXECUTION_MODE = 'sequential'
+        preload()
+
+    sock = bind_socket(config.HOST, config.PORT)
+    print(f"🚀 Serving on {config.HOST}:{config.PORT} with {processes} worker processes")
+
+    targets = [(name, target) for name, target in (services or {}).items()]
+    targets += [(f"Worker {i}", partial(run_api_worker, app, sock, i, worker_init)) for i in range(processes)]
+
+    # Keep the garbage collector from writing to the shared objects' pages
+    gc.collect()
+    gc.freeze()
+    Supervisor(targets).run()
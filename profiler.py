@@ -0,0 +1,75 @@
+"""
+On-demand sampling profiler
+Samples the Python stack of every thread at a fixed interval and returns
+the counts in the collapsed-stack format read by flamegraph.pl, speedscope
+and similar tools:
+
+    thread;outer_function (file:line);inner_function (file:line) 42
+
+Sampling only reads sys._current_frames() from one thread, so the rest of
+the process keeps running normally. Time spent in native code (ONNX Runtime,
+OpenCV) shows up on the Python frame that called it.
+"""
+
+import re
+import sys
+import threading
+import time
+from collections import Counter
+
+# Leaf frames of threads that are blocked waiting for work, dropped unless idle=True
+IDLE_FRAMES = {
+    ('threading.py', 'wait'),
+    ('selectors.py', 'select'),
+    ('base_events.py', '_run_once'),
+    ('thread.py', '_worker'),
+}
+
+# Install prefixes stripped from file names (site-packages, the standard library)
+PREFIX_PATTERN = re.compile(r'^.*/(site-packages|lib/python\d+\.\d+)/')
+
+_lock = threading.Lock()
+
+
+class ProfilerBusyError(Exception):
+    """Raised when a profile is requested while another one is running"""
+
+
+def frame_label(frame):
+    """Function name with its file (shortened to the package path) and first line"""
+    code = frame.f_code
+    filename = PREFIX_PATTERN.sub('', code.co_filename)
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})".replace(';', ':')
+
+
+def is_idle(frame):
+    code = frame.f_code
+    return (code.co_filename.rsplit('/', 1)[-1], code.co_name) in IDLE_FRAMES
+
+
+def sample(seconds, interval=0.01, idle=False):
+    """Sample every thread's stack for seconds; returns collapsed stacks as text
+
+    Runs in the calling thread, which is left out of the samples.
+    """
+    if not _lock.acquire(blocking=False):
+        raise ProfilerBusyError("A profile is already running")
+    try:
+        me = threading.get_ident()
+        stacks = Counter()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me or (not idle and is_idle(frame)):
+                    continue
+                labels = []
+                while frame is not None:
+                    labels.append(frame_label(frame))
+                    frame = frame.f_back
+                labels.append(names.get(ident, f"thread-{ident}").replace(';', ':'))
+                stacks[';'.join(reversed(labels))] += 1
+            time.sleep(interval)
+    finally:
+        _lock.release()
+    return ''.join(f"{stack} {count}\n" for stack, count in stacks.most_common())
@@ -0,0 +1,305 @@
+"""
+Create INT8 quantized InsightFace models
+Writes an alternate model pack whose detector and recognizer are quantized,
+and compares its accuracy and speed with the FP32 pack on a dataset.
+
+Usage:
+    python quantize_models.py --mode dynamic
+    python quantize_models.py --mode static --calibration-dir calibration_faces/
+    python quantize_models.py --mode static --calibration-dir calibration_faces/ \
+        --pairs-file pairs_CALFW.txt --images-dir "calfw/aligned images" --max-pairs 2000
+    python quantize_models.py --compare-only --pairs-file ... --images-dir ...
+
+Serve the quantized pack with:
+    FACE_MODEL_NAME=buffalo_l_int8 python server.py
+"""
+
+import argparse
+import glob
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+import onnxruntime
+from insightface.utils import face_align
+from onnxruntime.quantization import (CalibrationDataReader, CalibrationMethod, QuantFormat, QuantType,
+                                      quant_pre_process, quantize_dynamic, quantize_static)
+
+import config
+from face_models import build_face_model, build_recognition_model, models_root, route_model
+
+# Models replaced by INT8 versions; the rest of the pack is copied unchanged
+QUANTIZED_TASKS = ('detection', 'recognition')
+
+CALIBRATION_METHODS = {
+    'minmax': CalibrationMethod.MinMax,
+    'entropy': CalibrationMethod.Entropy,
+    'percentile': CalibrationMethod.Percentile,
+}
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+
+
+def pack_dir(model_name):
+    """Directory of a model pack under the models root"""
+    return os.path.join(os.path.expanduser(models_root()), 'models', model_name)
+
+
+def task_models(model_dir):
+    """{taskname: onnx file} for every model in a pack"""
+    tasks = {}
+    for onnx_file in sorted(glob.glob(os.path.join(model_dir, '*.onnx'))):
+        session = onnxruntime.InferenceSession(onnx_file, providers=['CPUExecutionProvider'])
+        model = route_model(onnx_file, session)
+        if model is not None:
+            tasks[model.taskname] = onnx_file
+    return tasks
+
+
+class BlobReader(CalibrationDataReader):
+    """Feeds preprocessed input blobs to the static quantizer one at a time"""
+
+    def __init__(self, input_name, blobs):
+        self.input_name = input_name
+        self.blobs = iter(blobs)
+
+    def get_next(self):
+        blob = next(self.blobs, None)
+        return None if blob is None else {self.input_name: blob}
+
+
+def load_calibration_images(calibration_dir, limit):
+    """BGR calibration images from a folder of face photos"""
+    paths = sorted(p for p in Path(calibration_dir).rglob('*') if p.suffix.lower() in IMAGE_EXTENSIONS)[:limit]
+    images = [cv2.imread(str(p)) for p in paths]
+    images = [img for img in images if img is not None]
+    if not images:
+        raise ValueError(f"No readable images in {calibration_dir}")
+    return images
+
+
+def detector_blobs(det_model, images, det_size):
+    """Letterboxed detector inputs, preprocessed as RetinaFace.detect does"""
+    blobs = []
+    for img in images:
+        scale = det_size / max(img.shape[:2])
+        resized = cv2.resize(img, (int(img.shape[1] * scale), int(img.shape[0] * scale)))
+        canvas = np.zeros((det_size, det_size, 3), dtype=np.uint8)
+        canvas[:resized.shape[0], :resized.shape[1]] = resized
+        blobs.append(cv2.dnn.blobFromImage(
+            canvas, 1.0 / det_model.input_std, (det_size, det_size),
+            (det_model.input_mean,) * 3, swapRB=True
+        ))
+    return blobs
+
+
+def recognizer_blobs(face_model, rec_model, images):
+    """Aligned face crops found by the FP32 detector, preprocessed as ArcFaceONNX does"""
+    blobs = []
+    for img in images:
+        faces = face_model.get(img)
+        if not faces:
+            continue
+        crop = face_align.norm_crop(img, landmark=faces[0].kps, image_size=rec_model.input_size[0])
+        blobs.append(cv2.dnn.blobFromImage(
+            crop, 1.0 / rec_model.input_std, rec_model.input_size,
+            (rec_model.input_mean,) * 3, swapRB=True
+        ))
+    if not blobs:
+        raise ValueError("No faces found in the calibration images")
+    return blobs
+
+
+def quantize_model(src, dst, mode, blobs=None, calibrate_method='minmax'):
+    """Write an INT8 copy of one ONNX model"""
+    with tempfile.TemporaryDirectory() as tmp:
+        # Shape inference and graph cleanup give the quantizer more to work with
+        prepared = os.path.join(tmp, 'prepared.onnx')
+        try:
+            quant_pre_process(src, prepared, skip_symbolic_shape=True)
+        except Exception as e:
+            print(f"⚠️  Pre-processing skipped for {os.path.basename(src)}: {e}")
+            prepared = src
+
+        if mode == 'dynamic':
+            # ConvInteger only has uint8 kernels on CPU
+            quantize_dynamic(prepared, dst, weight_type=QuantType.QUInt8)
+        else:
+            input_name = onnxruntime.InferenceSession(src, providers=['CPUExecutionProvider']).get_inputs()[0].name
+            quantize_static(
+                prepared, dst, BlobReader(input_name, blobs),
+                quant_format=QuantFormat.QDQ,
+                per_channel=True,
+                activation_type=QuantType.QUInt8,
+                weight_type=QuantType.QInt8,
+                calibrate_method=CALIBRATION_METHODS[calibrate_method]
+            )
+
+
+def build_int8_pack(args):
+    """Quantize the detector and recognizer of args.source into args.output"""
+    source_dir = pack_dir(args.source)
+    output_dir = pack_dir(args.output)
+    tasks = task_models(source_dir)
+    missing = [task for task in QUANTIZED_TASKS if task not in tasks]
+    if missing:
+        raise ValueError(f"No {', '.join(missing)} model in {source_dir}")
+
+    os.makedirs(output_dir, exist_ok=True)
+    quantized_files = {tasks[task] for task in QUANTIZED_TASKS}
+    for onnx_file in sorted(glob.glob(os.path.join(source_dir, '*.onnx'))):
+        if onnx_file not in quantized_files:
+            shutil.copy2(onnx_file, output_dir)
+
+    det_blobs = rec_blobs = None
+    if args.mode == 'static':
+        print(f"📥 Loading calibration images from {args.calibration_dir}")
+        images = load_calibration_images(args.calibration_dir, args.calibration_images)
+        face_model = build_face_model(1, 'fast', args.source)
+        rec_model = build_recognition_model(args.source)
+        det_blobs = detector_blobs(face_model.det_model, images, max(config.DET_SIZES))
+        rec_blobs = recognizer_blobs(face_model, rec_model, images)
+        print(f"✅ {len(det_blobs)} detector and {len(rec_blobs)} recognizer calibration inputs")
+
+    for task, blobs in (('detection', det_blobs), ('recognition', rec_blobs)):
+        src = tasks[task]
+        dst = os.path.join(output_dir, os.path.basename(src))
+        t0 = time.perf_counter()
+        quantize_model(src, dst, args.mode, blobs, args.calibrate_method)
+        size_mb = os.path.getsize(dst) / (1024 * 1024)
+        print(f"✅ {task}: {os.path.basename(dst)} ({size_mb:.1f} MB, {time.perf_counter() - t0:.1f}s)")
+
+    print(f"📁 INT8 pack written to {output_dir}")
+
+
+def embed_images(model_name, images):
+    """Embeddings and mean per-image latency (ms) for one model pack"""
+    import server
+
+    face_model = build_face_model(1, 'fast', model_name)
+    rec_model = build_recognition_model(model_name)
+    crop_size = rec_model.input_size[0]
+
+    embeddings, latencies = {}, []
+    for name, image_bytes in images.items():
+        t0 = time.perf_counter()
+        try:
+            crop = server.detect_face(face_model, image_bytes, name, crop_size)
+        except server.HTTPException:
+            continue
+        embeddings[name] = server.normalize_embedding(rec_model.get_feat(crop)[0])
+        latencies.append((time.perf_counter() - t0) * 1000)
+    return embeddings, float(np.mean(latencies)) if latencies else 0.0
+
+
+def compare_packs(args):
+    """Evaluate FP32 and INT8 packs on the same pairs with evaluate_all's metrics"""
+    sys.path.insert(0, str(Path(__file__).parent / 'evaluation'))
+    from evaluate_all import FaceVerificationEvaluator
+
+    evaluator = FaceVerificationEvaluator()
+    pairs = evaluator.select_pairs(evaluator.load_pairs(args.pairs_file), args.max_pairs)
+    names = sorted({name for pair in pairs for name in (pair['img1'], pair['img2'])})
+    images = {}
+    for name in names:
+        path = os.path.join(args.images_dir, name)
+        if os.path.exists(path):
+            images[name] = Path(path).read_bytes()
+
+    report = {'pairs_file': args.pairs_file, 'packs': {}}
+    all_embeddings = {}
+    for label, model_name in (('fp32', args.source), ('int8', args.output)):
+        print(f"🔄 Embedding {len(images)} images with {model_name}...")
+        embeddings, image_ms = embed_images(model_name, images)
+        all_embeddings[label] = embeddings
+
+        y_true, y_scores = [], []
+        for pair in pairs:
+            e1, e2 = embeddings.get(pair['img1']), embeddings.get(pair['img2'])
+            if e1 is not None and e2 is not None:
+                y_true.append(pair['label'])
+                y_scores.append((float(np.dot(e1, e2)) + 1) / 2)
+        metrics = evaluator.compute_metrics(label, y_true, y_scores, len(pairs), len(pairs) - len(y_true))
+        report['packs'][label] = {'model_name': model_name, 'image_ms': round(image_ms, 2), 'metrics': metrics}
+
+    # Per-image agreement between the two packs
+    shared = sorted(set(all_embeddings['fp32']) & set(all_embeddings['int8']))
+    cosines = np.array([np.dot(all_embeddings['fp32'][n], all_embeddings['int8'][n]) for n in shared])
+    report['embedding_cosine'] = {
+        'images': len(shared),
+        'mean': round(float(cosines.mean()), 4) if len(cosines) else None,
+        'min': round(float(cosines.min()), 4) if len(cosines) else None
+    }
+
+    fp32, int8 = report['packs']['fp32'], report['packs']['int8']
+    print(f"\n{'='*60}")
+    print("📈 FP32 vs INT8")
+    print(f"{'='*60}")
+    print(f"{'':24s} {'FP32':>10s} {'INT8':>10s}")
+    print(f"{'Latency / image (ms)':24s} {fp32['image_ms']:10.2f} {int8['image_ms']:10.2f}")
+    if fp32['metrics'] and int8['metrics']:
+        rows = [
+            ('AUC', 'auc', None),
+            ('Optimal threshold (%)', 'threshold', 'optimal_threshold'),
+            ('Accuracy @ optimal (%)', 'accuracy', 'optimal_threshold'),
+            ('Accuracy @ 65 (%)', 'accuracy', 'default_threshold'),
+        ]
+        for title, key, group in rows:
+            a = fp32['metrics'][group][key] if group else fp32['metrics'][key]
+            b = int8['metrics'][group][key] if group else int8['metrics'][key]
+            print(f"{title:24s} {a:10.4f} {b:10.4f}")
+    print(f"Embedding cosine FP32/INT8: mean {report['embedding_cosine']['mean']}, min {report['embedding_cosine']['min']}")
+    if int8['image_ms']:
+        print(f"💡 Speedup: {fp32['image_ms'] / int8['image_ms']:.2f}x")
+
+    os.makedirs(os.path.dirname(args.report) or '.', exist_ok=True)
+    with open(args.report, 'w') as f:
+        json.dump(report, f, indent=4)
+    print(f"\n✅ Report saved to {args.report}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Quantize InsightFace models to INT8")
+    parser.add_argument('--mode', choices=['dynamic', 'static'], default='dynamic')
+    parser.add_argument('--source', default=config.MODEL_NAME, help="FP32 model pack")
+    parser.add_argument('--output', help="INT8 model pack name (default: <source>_int8)")
+    parser.add_argument('--calibration-dir', help="Folder of face images for static calibration")
+    parser.add_argument('--calibration-images', type=int, default=200, help="Calibration images to use")
+    parser.add_argument('--calibrate-method', choices=list(CALIBRATION_METHODS), default='minmax')
+    parser.add_argument('--pairs-file', help="Evaluation pairs file for the FP32 vs INT8 comparison")
+    parser.add_argument('--images-dir', help="Evaluation image directory")
+    parser.add_argument('--max-pairs', type=int, default=1000, help="Balanced sample of pairs (0 = all)")
+    parser.add_argument('--compare-only', action='store_true', help="Skip quantization, only compare")
+    parser.add_argument('--report', default='evaluation/results_int8.json')
+    args = parser.parse_args()
+    args.output = args.output or f"{args.source}_int8"
+
+    if args.mode == 'static' and not args.compare_only and not args.calibration_dir:
+        parser.error("--mode static needs --calibration-dir")
+    if bool(args.pairs_file) != bool(args.images_dir):
+        parser.error("--pairs-file and --images-dir go together")
+    if args.compare_only and not args.pairs_file:
+        parser.error("--compare-only needs --pairs-file and --images-dir")
+
+    print("="*60)
+    print("🗜️  INT8 Model Quantization")
+    print("="*60)
+
+    if not args.compare_only:
+        build_int8_pack(args)
+    if args.pairs_file:
+        compare_packs(args)
+    else:
+        print("\n💡 Pass --pairs-file and --images-dir to compare accuracy with the FP32 pack")
+
+    print(f"\n✨ Serve it with: FACE_MODEL_NAME={args.output} python server.py")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,26 +1,91 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi import FastAPI, UploadFile, File, Form, Header, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response
+from starlette.concurrency import run_in_threadpool
 from contextlib import asynccontextmanager
+import asyncio
+import hmac
+import json
+import os
+import threading
+import time
+from concurrent.futures import Future
+from functools import partial
+from typing import List
 import cv2
 import numpy as np
 from PIL import Image
 import io
 import uvicorn
-import insightface
-from insightface.app import FaceAnalysis
-from pathlib import Path
+from insightface.utils import face_align
 
-# Initialize InsightFace model (global variable)
-face_model = None
+import config
+import metrics
+from batching import RecognitionBatcher
+from embedding_cache import EmbeddingCache
+from face_models import build_face_model, build_recognition_model
+from model_pool import ModelPool
+import prefork
+import profiler
+from prefork import process_memory
+from shm_inference import InferenceClient, InferenceError, InferenceServer, create_channels
+from template_store import TemplateStore, TemplateExistsError
+
+# Pools of InsightFace detection replicas (one per pipeline profile)
+# and the shared recognition batcher (global variables)
+model_pools = {}
+batcher = None
+
+# Normalized embeddings keyed by upload content
+embedding_cache = EmbeddingCache(int(config.CACHE_MAX_MB * 1024 * 1024))
+
+# Enrolled templates for verify-by-id (global variable)
+template_store = None
+
+# Models loaded by the pre-fork master and inherited by every worker
+preloaded = None
+
+# Connection to the shared-memory inference process (FACE_INFERENCE_MODE=shm)
+inference_client = None
+
+# Queue depths and cache counters, read when /metrics is scraped
+metrics.REGISTRY.register(metrics.CallbackMetric(
+    "face_replica_queue_depth", "Detection jobs waiting for a free replica", "gauge",
+    lambda: {(profile,): pool.waiting for profile, pool in model_pools.items()}, ("profile",)
+))
+metrics.REGISTRY.register(metrics.CallbackMetric(
+    "face_recognition_queue_depth", "Aligned crops waiting for the recognition batcher", "gauge",
+    lambda: batcher.queue_depth if batcher is not None else 0
+))
+metrics.REGISTRY.register(metrics.CallbackMetric(
+    "face_inference_pending", "Requests sent to the shared-memory inference process awaiting a response", "gauge",
+    lambda: inference_client.pending if inference_client is not None else 0
+))
+metrics.REGISTRY.register(metrics.CallbackMetric(
+    "face_cache_requests_total", "Embedding cache lookups by result", "counter",
+    lambda: {("hit",): embedding_cache.hits, ("miss",): embedding_cache.misses}, ("result",)
+))
+metrics.REGISTRY.register(metrics.CallbackMetric(
+    "face_templates", "Enrolled templates", "gauge",
+    lambda: len(template_store) if template_store is not None else 0
+))
+
+# Startup progress reported by /health: loading -> warming -> ready (or failed)
+readiness = {"state": "loading", "load_seconds": None, "warmup_seconds": None, "error": None}
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Lifespan context manager for startup/shutdown events"""
-    # Startup: Load model
-    load_face_model()
+    # Startup: load and warm up the models in the background; /health reports progress
+    threading.Thread(target=start_up, name="face-startup", daemon=True).start()
     yield
-    # Shutdown: cleanup if needed
-    pass
+    # Shutdown: stop inference workers
+    for pool in model_pools.values():
+        pool.shutdown()
+    if batcher is not None:
+        batcher.shutdown()
+    if template_store is not None:
+        template_store.close()
 
 app = FastAPI(title="Face Verification API", lifespan=lifespan)
 
@@ -32,75 +97,455 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(metrics.MetricsMiddleware)
+
+def start_up():
+    """Load the models and templates, then warm up (background thread)"""
+    started = time.perf_counter()
+    if inference_client is not None:
+        inference_client.start()
+        wait_for_inference_process()
+    else:
+        load_face_model()
+    load_template_store()
+    readiness["load_seconds"] = round(time.perf_counter() - started, 2)
+    if inference_client is None and not model_pools:
+        readiness.update(state="failed", error="Face model not loaded")
+        return
+    
+    readiness["state"] = "warming"
+    started = time.perf_counter()
+    try:
+        warm_up()
+    except Exception as e:
+        print(f"❌ Warm-up failed: {e}")
+        readiness.update(state="failed", error=f"Warm-up failed: {e}")
+        return
+    readiness["warmup_seconds"] = round(time.perf_counter() - started, 2)
+    readiness["state"] = "ready"
+    print(f"✅ Ready: loaded in {readiness['load_seconds']}s, warmed up in {readiness['warmup_seconds']}s")
+    
+    if config.PROCESSES > 1:
+        memory = process_memory()
+        if memory is not None:
+            print(f"👷 Worker {os.getpid()} ready: {memory['private_mb']} MB private, {memory['shared_mb']} MB shared")
+
+def warm_up():
+    """Run synthetic inferences through every replica, detector size and batch size
+    
+    ONNX Runtime allocates buffers and selects kernels lazily, so without
+    this the first requests after a (re)start pay for it.
+    """
+    # API workers of the shm mode have no models; the inference process warms its own
+    if config.WARMUP_ROUNDS <= 0 or inference_client is not None:
+        return
+    for pool in model_pools.values():
+        pool.for_each_replica(lambda replica: replica.warm_up(config.WARMUP_ROUNDS))
+    batcher.warm_up(config.WARMUP_ROUNDS)
+
+def wait_for_inference_process():
+    """Block until the inference process answers (it warms up before serving)"""
+    crop = np.zeros((112, 112, 3), dtype=np.uint8)
+    while True:
+        try:
+            inference_client.submit(crop, "warm-up", aligned=True)[1].result()
+            return
+        except InferenceError as e:
+            if e.status != 503:
+                raise
+            print("⚠️  Inference process restarted, waiting for it again")
+
+def check_ready():
+    """Reject requests while the models are still loading or warming up"""
+    if readiness["state"] in ("loading", "warming"):
+        raise HTTPException(
+            status_code=503,
+            detail=f"Service is {readiness['state']}, retry shortly",
+            headers={"Retry-After": "1"}
+        )
 
 def load_face_model():
-    """Load InsightFace model on startup"""
-    global face_model
+    """Load InsightFace model replicas and the recognition batcher on startup"""
+    global model_pools, batcher
     try:
-        # Check for local models directory
-        models_dir = Path(__file__).parent / "models"
-        
-        if models_dir.exists():
-            print(f"📁 Loading models from: {models_dir.absolute()}")
-            face_model = FaceAnalysis(
-                name='buffalo_l',
-                root=str(models_dir),
-                providers=['CPUExecutionProvider']
-            )
-        else:
-            print("⚠️  Local models not found. Downloading to default location...")
-            print("💡 Tip: Run 'python download_models.py' to download models locally")
-            face_model = FaceAnalysis(providers=['CPUExecutionProvider'])
+        if preloaded is None:
+            if config.MODELS_DIR.exists():
+                print(f"📁 Loading models from: {config.MODELS_DIR.absolute()}")
+            else:
+                print("⚠️  Local models not found. Downloading to default location...")
+                print("💡 Tip: Run 'python download_models.py' to download models locally")
+        
+        if config.DEFAULT_PROFILE not in config.PROFILES:
+            raise ValueError(f"Default profile '{config.DEFAULT_PROFILE}' is not in FACE_PROFILES")
         
-        face_model.prepare(ctx_id=0, det_size=(640, 640))
-        print("✅ InsightFace model loaded successfully")
+        workers = config.NUM_WORKERS
+        batcher = RecognitionBatcher(
+            preloaded['rec_model'] if preloaded is not None else build_recognition_model(),
+            max_batch_size=config.BATCH_MAX_SIZE,
+            max_wait_ms=config.BATCH_MAX_WAIT_MS
+        )
+        for profile in config.PROFILES:
+            if preloaded is not None:
+                factory = partial(next, iter(preloaded['replicas'][profile]))
+            else:
+                factory = partial(build_face_model, workers, profile)
+            model_pools[profile] = ModelPool(factory, workers)
+        print(f"✅ InsightFace model loaded successfully ({workers} replicas, profiles: {', '.join(model_pools)})")
     except Exception as e:
         print(f"❌ Error loading model: {e}")
-        face_model = None
+        model_pools = {}
+
+def open_template_store():
+    """Template store configured from the environment"""
+    index_params = {}
+    if config.INDEX_TYPE == "ivf_flat":
+        index_params = {"nlist": config.IVF_NLIST, "nprobe": config.IVF_NPROBE}
+    return TemplateStore(
+        config.TEMPLATES_DIR,
+        config.MODEL_NAME,
+        index_kind=config.INDEX_TYPE,
+        index_params=index_params,
+        index_min_size=config.INDEX_MIN_SIZE,
+        shared=config.PROCESSES > 1
+    )
 
-def preprocess_image(image_bytes):
-    """Convert uploaded image to OpenCV format"""
+def load_template_store():
+    """Open the persistent template store on startup"""
+    global template_store
     try:
-        image = Image.open(io.BytesIO(image_bytes))
-        
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
-            
-        img_array = np.array(image)
-        img_bgr = cv2.cvtColor(img_array, cv2.COLOR_RGB2BGR)
-        
+        template_store = preloaded['template_store'] if preloaded is not None else open_template_store()
+        print(f"✅ Template store loaded: {len(template_store)} templates in {config.TEMPLATES_DIR}")
+    except Exception as e:
+        print(f"❌ Error loading template store: {e}")
+        template_store = None
+
+def preload_models():
+    """Load replicas, the recognition model and templates before forking workers
+    
+    Nothing started here may own a thread; workers build their pools and
+    batcher around these objects after the fork.
+    """
+    global preloaded
+    if config.DEFAULT_PROFILE not in config.PROFILES:
+        raise ValueError(f"Default profile '{config.DEFAULT_PROFILE}' is not in FACE_PROFILES")
+    print(f"📁 Loading models from: {config.MODELS_DIR.absolute()}")
+    preloaded = {
+        'rec_model': build_recognition_model(),
+        'replicas': {
+            profile: [build_face_model(config.NUM_WORKERS, profile) for _ in range(config.NUM_WORKERS)]
+            for profile in config.PROFILES
+        },
+        'template_store': open_template_store()
+    }
+    print(f"✅ Models preloaded ({config.NUM_WORKERS} replicas per process, profiles: {', '.join(config.PROFILES)})")
+
+# Reduced-resolution JPEG decode flags by scale factor (DCT-domain scaling)
+JPEG_REDUCED_FLAGS = {
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+}
+
+def decode_scale(width, height, min_side):
+    """Largest JPEG reduction factor that keeps the longer side >= min_side"""
+    for factor in JPEG_REDUCED_FLAGS:
+        if max(width, height) // factor >= min_side:
+            return factor
+    return 1
+
+def preprocess_image(image_bytes, min_side=None):
+    """Decode uploaded bytes straight to a BGR array
+    
+    Only the header is parsed before the pixel-count check. JPEGs far larger
+    than min_side are decoded at 1/2, 1/4 or 1/8 scale by libjpeg, so a
+    phone photo never materializes at full resolution.
+    """
+    try:
+        header = Image.open(io.BytesIO(image_bytes))
+        width, height = header.size
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Image processing error: {str(e)}")
+    
+    if width * height > config.MAX_IMAGE_PIXELS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Image too large: {width}x{height} pixels (max {config.MAX_IMAGE_PIXELS})"
+        )
+    
+    flags = cv2.IMREAD_COLOR
+    if header.format == 'JPEG':
+        factor = decode_scale(width, height, min_side or config.DECODE_MIN_SIDE)
+        if factor > 1:
+            flags = JPEG_REDUCED_FLAGS[factor]
+    
+    # EXIF orientation is ignored, as with the previous PIL decode
+    img_bgr = cv2.imdecode(np.frombuffer(image_bytes, dtype=np.uint8), flags | cv2.IMREAD_IGNORE_ORIENTATION)
+    if img_bgr is not None:
         return img_bgr
+    
+    # Formats OpenCV cannot decode (e.g. GIF) go through PIL
+    try:
+        image = header.convert('RGB')
+        return cv2.cvtColor(np.asarray(image), cv2.COLOR_RGB2BGR)
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Image processing error: {str(e)}")
 
-def calculate_similarity(img1, img2):
-    """Calculate face similarity using InsightFace"""
-    if face_model is None:
+def detect_face(face_model, image_bytes, image_label, crop_size, det_size=None):
+    """Decode an uploaded image and align its first face (runs on a worker)"""
+    with metrics.stage("decode"):
+        img = preprocess_image(image_bytes)
+    return align_face(face_model, img, image_label, crop_size, det_size)
+
+def align_face(face_model, img, image_label, crop_size, det_size=None):
+    """Aligned crop of the first face detected in a BGR image"""
+    with metrics.stage("detect"):
+        faces = face_model.get(img, det_size=det_size)
+    metrics.FACES_DETECTED.inc(amount=len(faces))
+    
+    if len(faces) == 0:
+        metrics.NO_FACE.inc()
+        raise HTTPException(status_code=400, detail=f"No face detected in {image_label}")
+    
+    # Take first face if multiple detected
+    with metrics.stage("align"):
+        return face_align.norm_crop(img, landmark=faces[0].kps, image_size=crop_size)
+
+def models_loaded():
+    """Whether this process can embed faces, itself or through the inference process"""
+    if inference_client is not None:
+        # shm API workers hold no models: the inference process answering is what counts
+        return readiness["state"] == "ready"
+    return bool(model_pools)
+
+def serving_profiles():
+    """Pipeline profiles requests can use"""
+    return config.PROFILES if inference_client is not None else list(model_pools)
+
+def serving_workers():
+    """Detection replicas per profile (in the inference process in shm mode)"""
+    return config.NUM_WORKERS if model_pools or inference_client is not None else 0
+
+def get_model_pool(profile):
+    """Replica pool for a pipeline profile (default profile when None)"""
+    if not model_pools:
         raise HTTPException(status_code=500, detail="Face model not loaded")
+    profile = profile or config.DEFAULT_PROFILE
+    if profile not in model_pools:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Pipeline profile '{profile}' not loaded, available: {', '.join(model_pools)}"
+        )
+    return model_pools[profile]
+
+def check_profile(profile):
+    """Reject pipeline profiles this server does not serve"""
+    profile = profile or config.DEFAULT_PROFILE
+    if inference_client is None:
+        get_model_pool(profile)
+    elif profile not in config.PROFILES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Pipeline profile '{profile}' not loaded, available: {', '.join(config.PROFILES)}"
+        )
+    return profile
+
+def check_det_size(det_size):
+    """Reject detector sizes the replicas were not prepared for"""
+    if det_size is not None and det_size not in config.DET_SIZES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"det_size must be one of {', '.join(map(str, config.DET_SIZES))}"
+        )
+
+def normalize_embedding(embedding):
+    """Scale an embedding to unit length so cosine similarity is a dot product"""
+    embedding = np.asarray(embedding, dtype=np.float32)
+    return embedding / np.linalg.norm(embedding)
+
+def prepare_aligned_face(image_bytes, crop_size):
+    """Decode a pre-aligned face crop and resize it for the recognition model
+    
+    Non-square crops are center-cropped to a square first so the face is not
+    stretched.
+    """
+    with metrics.stage("decode"):
+        img = preprocess_image(image_bytes, min_side=crop_size)
+    return center_square(img, crop_size)
+
+def center_square(img, crop_size):
+    """Center-crop a BGR image to a square and resize it to crop_size"""
+    height, width = img.shape[:2]
+    if height != width:
+        side = min(height, width)
+        top, left = (height - side) // 2, (width - side) // 2
+        img = img[top:top + side, left:left + side]
+    if img.shape[0] != crop_size:
+        img = cv2.resize(img, (crop_size, crop_size), interpolation=cv2.INTER_AREA)
+    return img
+
+async def extract_embedding(image_bytes, image_label, profile=None, aligned=False, det_size=None):
+    """Normalized embedding of an upload, served from the cache when possible
     
+    With aligned=True the upload is treated as an aligned face crop and goes
+    straight to the recognition model, skipping face detection. det_size
+    overrides the detector input size picked from the image dimensions.
+    """
+    check_ready()
+    profile = check_profile(profile)
+    check_det_size(det_size)
+    
+    cache_key = EmbeddingCache.make_key(image_bytes, config.MODEL_NAME, profile, aligned, det_size)
+    embedding = embedding_cache.get(cache_key)
+    if embedding is not None:
+        return embedding
+    
+    if inference_client is not None:
+        embedding = await remote_embedding(image_bytes, image_label, profile, aligned, det_size)
+        embedding_cache.put(cache_key, embedding)
+        return embedding
+    
+    if aligned:
+        # Decode and resize only; no detector replica needed
+        crop = await run_in_threadpool(prepare_aligned_face, image_bytes, batcher.crop_size)
+    else:
+        # Detect on a replica, then embed through the recognition batcher
+        crop = await get_model_pool(profile).run(detect_face, image_bytes, image_label, batcher.crop_size, det_size)
+    with metrics.stage("recognize"):
+        embedding = normalize_embedding(await asyncio.wrap_future(batcher.submit(crop)))
+    embedding_cache.put(cache_key, embedding)
+    return embedding
+
+def submit_to_inference(image_bytes, image_label, profile, aligned, det_size):
+    """Decode an upload and queue its pixels for the inference process"""
+    if aligned:
+        # Same decode as the in-process path, so both give the same crop
+        img = prepare_aligned_face(image_bytes, inference_client.crop_size)
+    else:
+        with metrics.stage("decode"):
+            img = preprocess_image(image_bytes)
+    return inference_client.submit(
+        img, image_label, config.PROFILES.index(profile), det_size, aligned, timeout=config.SHM_TIMEOUT_S
+    )
+
+async def remote_embedding(image_bytes, image_label, profile, aligned, det_size):
+    """Normalized embedding computed by the shared-memory inference process"""
     try:
-        # Detect faces
-        faces1 = face_model.get(img1)
-        faces2 = face_model.get(img2)
-        
-        if len(faces1) == 0:
-            raise HTTPException(status_code=400, detail="No face detected in image 1")
-        if len(faces2) == 0:
-            raise HTTPException(status_code=400, detail="No face detected in image 2")
-        
-        # Get embeddings (take first face if multiple detected)
-        embedding1 = faces1[0].embedding
-        embedding2 = faces2[0].embedding
-        
-        # Calculate cosine similarity
-        similarity = np.dot(embedding1, embedding2) / (
-            np.linalg.norm(embedding1) * np.linalg.norm(embedding2)
-        )
+        request_id, future = await run_in_threadpool(submit_to_inference, image_bytes, image_label, profile, aligned, det_size)
+        try:
+            with metrics.stage("inference"):
+                return await asyncio.wait_for(asyncio.wrap_future(future), config.SHM_TIMEOUT_S)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            # Do not keep waiting for a response that may never come
+            inference_client.cancel(request_id)
+            raise
+    except InferenceError as e:
+        if e.status == 400 and e.detail.startswith("No face detected"):
+            metrics.NO_FACE.inc()
+        raise HTTPException(status_code=e.status, detail=e.detail)
+    except (TimeoutError, asyncio.TimeoutError):
+        raise HTTPException(status_code=503, detail="Inference process did not answer in time")
+
+def run_inference_process(channels, doorbell):
+    """Dedicated inference process: detect, align and embed images from every API worker"""
+    started = time.perf_counter()
+    load_face_model()
+    if not model_pools:
+        raise RuntimeError("Inference process could not load the models")
+    load_seconds = time.perf_counter() - started
+    started = time.perf_counter()
+    warm_up()
+    print(f"🔥 Inference process loaded in {load_seconds:.2f}s, warmed up in {time.perf_counter() - started:.2f}s")
+    
+    def handle(img, image_label, profile_index, det_size, aligned):
+        result = Future()
         
-        # Convert to percentage (0-100)
-        similarity_percent = float((similarity + 1) * 50)  # Scale from [-1,1] to [0,100]
+        def embedded(future):
+            try:
+                result.set_result(normalize_embedding(future.result()))
+            except Exception as e:
+                result.set_exception(e)
         
-        return round(similarity_percent, 2)
+        def detected(future):
+            try:
+                batcher.submit(future.result()).add_done_callback(embedded)
+            except Exception as e:
+                result.set_exception(e)
+        
+        if aligned:
+            batcher.submit(center_square(img, batcher.crop_size)).add_done_callback(embedded)
+        else:
+            pool = model_pools[config.PROFILES[profile_index]]
+            pool.submit(align_face, img, image_label, batcher.crop_size, det_size).add_done_callback(detected)
+        return result
+    
+    for channel in channels:
+        channel.crop_size.value = batcher.crop_size
+    print(f"✅ Inference process ready for {len(channels)} API workers")
+    InferenceServer(channels, doorbell, reply_timeout=config.SHM_TIMEOUT_S).serve(handle)
+
+def attach_inference_client(channels, doorbell, index):
+    """Connect API worker index to its shared-memory channel (runs after fork)"""
+    global inference_client
+    inference_client = InferenceClient(channels[index], doorbell)
+
+def serve_with_inference_process():
+    """API workers that only decode, plus one process running every model"""
+    channels, doorbell = create_channels(
+        config.PROCESSES, config.SHM_SLOTS, int(config.SHM_SLOT_MB * 1024 * 1024)
+    )
+    try:
+        prefork.serve(
+            app,
+            config.PROCESSES,
+            worker_init=partial(attach_inference_client, channels, doorbell),
+            services={"Inference": partial(run_inference_process, channels, doorbell)}
+        )
+    finally:
+        for channel in channels:
+            channel.unlink()
+
+async def read_upload(upload):
+    """Bytes of an uploaded file"""
+    with metrics.stage("read"):
+        return await upload.read()
+
+def similarity_to_percent(similarity):
+    """Scale cosine similarity from [-1,1] to a 0-100 score"""
+    return round(float((similarity + 1) * 50), 2)
+
+def verification_result(similarity_score, profile=None):
+    """API response for a similarity score"""
+    # Determine if same person (InsightFace threshold: typically 60-70%)
+    is_same_person = similarity_score > 65.0
+    
+    if similarity_score > 75:
+        confidence = "high"
+    elif similarity_score > 60:
+        confidence = "medium"
+    else:
+        confidence = "low"
+    
+    return {
+        "similarity_score": similarity_score,
+        "is_same_person": is_same_person,
+        "confidence": confidence,
+        "model": "InsightFace ArcFace",
+        "profile": profile or config.DEFAULT_PROFILE,
+        "status": "success"
+    }
+
+async def calculate_similarity(img1_bytes, img2_bytes, profile=None, aligned=False, det_size=None):
+    """Calculate face similarity using InsightFace"""
+    try:
+        # Decode, detect and embed both images in parallel
+        embedding1, embedding2 = await asyncio.gather(
+            extract_embedding(img1_bytes, "image 1", profile, aligned, det_size),
+            extract_embedding(img2_bytes, "image 2", profile, aligned, det_size)
+        )
+        
+        # Cosine similarity of unit-length embeddings
+        with metrics.stage("score"):
+            return similarity_to_percent(np.dot(embedding1, embedding2))
         
     except HTTPException:
         raise
@@ -109,7 +554,7 @@ def calculate_similarity(img1, img2):
 
 @app.get("/")
 def read_root():
-    model_status = "loaded" if face_model is not None else "not loaded"
+    model_status = "loaded" if models_loaded() else "not loaded"
     return {
         "message": "Face Verification API is running!",
         "model_status": model_status,
@@ -119,37 +564,121 @@ def read_root():
 @app.post("/verify_faces")
 async def verify_faces(
     image1: UploadFile = File(...),
-    image2: UploadFile = File(...)
+    image2: UploadFile = File(...),
+    profile: str = Query(None, description="Pipeline profile (defaults to FACE_DEFAULT_PROFILE)"),
+    aligned: bool = Query(False, description="Images are aligned face crops: skip face detection"),
+    det_size: int = Query(None, description="Detector input size (one of FACE_DET_SIZES); chosen per image when omitted")
 ):
     """Compare two face images and return similarity score"""
     
     try:
         # Read uploaded files
-        img1_bytes = await image1.read()
-        img2_bytes = await image2.read()
+        img1_bytes = await read_upload(image1)
+        img2_bytes = await read_upload(image2)
         
-        # Preprocess images
-        img1 = preprocess_image(img1_bytes)
-        img2 = preprocess_image(img2_bytes)
+        # Calculate similarity using InsightFace (off the event loop)
+        similarity_score = await calculate_similarity(img1_bytes, img2_bytes, profile, aligned, det_size)
         
-        # Calculate similarity using InsightFace
-        similarity_score = calculate_similarity(img1, img2)
+        return verification_result(similarity_score, profile)
         
-        # Determine if same person (InsightFace threshold: typically 60-70%)
-        is_same_person = similarity_score > 65.0
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+def parse_pairs(pairs_json, num_images):
+    """Validate the pairs form field: a JSON list of [i, j] image indices"""
+    try:
+        pairs = np.asarray(json.loads(pairs_json))
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="pairs must be a JSON list of [i, j] index pairs")
+    
+    if pairs.size == 0:
+        pairs = np.empty((0, 2), dtype=np.int64)
+    if pairs.ndim != 2 or pairs.shape[1] != 2 or not np.issubdtype(pairs.dtype, np.integer):
+        raise HTTPException(status_code=400, detail="pairs must be a JSON list of [i, j] index pairs")
+    if len(pairs) > config.BATCH_MAX_PAIRS:
+        raise HTTPException(status_code=400, detail=f"At most {config.BATCH_MAX_PAIRS} pairs per request")
+    if len(pairs) and (pairs.min() < 0 or pairs.max() >= num_images):
+        raise HTTPException(status_code=400, detail=f"Pair indices must be between 0 and {num_images - 1}")
+    return pairs
+
+@app.post("/verify_batch")
+async def verify_batch(
+    images: List[UploadFile] = File(...),
+    pairs: str = Form(..., description="JSON list of [i, j] indices into images"),
+    profile: str = Query(None, description="Pipeline profile (defaults to FACE_DEFAULT_PROFILE)"),
+    aligned: bool = Query(False, description="Images are aligned face crops: skip face detection"),
+    det_size: int = Query(None, description="Detector input size (one of FACE_DET_SIZES); chosen per image when omitted")
+):
+    """Score many image pairs, embedding every distinct image only once"""
+    if len(images) > config.BATCH_MAX_IMAGES:
+        raise HTTPException(status_code=400, detail=f"At most {config.BATCH_MAX_IMAGES} images per request")
+    check_ready()
+    # A bad profile is the request's fault, not a per-image failure
+    check_profile(profile)
+    check_det_size(det_size)
+    
+    try:
+        image_bytes = [await read_upload(image) for image in images]
+        pairs = parse_pairs(pairs, len(image_bytes))
         
-        if similarity_score > 75:
-            confidence = "high"
-        elif similarity_score > 60:
-            confidence = "medium"
-        else:
-            confidence = "low"
+        # Deduplicate by content: identical uploads share one embedding
+        unique_ids = {}
+        first_position = []
+        image_to_unique = []
+        for position, data in enumerate(image_bytes):
+            if data not in unique_ids:
+                unique_ids[data] = len(first_position)
+                first_position.append(position)
+            image_to_unique.append(unique_ids[data])
+        image_to_unique = np.array(image_to_unique, dtype=np.int64)
+        
+        # Embed all distinct images concurrently; recognition batches them
+        outcomes = await asyncio.gather(
+            *(extract_embedding(image_bytes[p], f"image {p}", profile, aligned, det_size) for p in first_position),
+            return_exceptions=True
+        )
+        
+        # Images without a face fail their pairs, not the whole request
+        errors = {}
+        for u, outcome in enumerate(outcomes):
+            if isinstance(outcome, HTTPException) and outcome.status_code < 500:
+                errors[u] = outcome.detail
+            elif isinstance(outcome, BaseException):
+                raise outcome
+        valid = [o for o in outcomes if not isinstance(o, BaseException)]
+        embeddings = np.zeros((len(outcomes), valid[0].shape[0] if valid else 1), dtype=np.float32)
+        for u, outcome in enumerate(outcomes):
+            if u not in errors:
+                embeddings[u] = outcome
+        
+        # Score every pair in one vectorized pass
+        with metrics.stage("score"):
+            left = image_to_unique[pairs[:, 0]]
+            right = image_to_unique[pairs[:, 1]]
+            similarities = np.einsum('ij,ij->i', embeddings[left], embeddings[right])
+        
+        results = []
+        for (i, j), u1, u2, similarity in zip(pairs.tolist(), left, right, similarities):
+            error = errors.get(u1) or errors.get(u2)
+            if error:
+                results.append({"pair": [i, j], "similarity_score": None, "is_same_person": None, "error": error})
+                continue
+            similarity_score = similarity_to_percent(similarity)
+            results.append({
+                "pair": [i, j],
+                "similarity_score": similarity_score,
+                "is_same_person": similarity_score > 65.0
+            })
         
         return {
-            "similarity_score": similarity_score,
-            "is_same_person": is_same_person,
-            "confidence": confidence,
+            "results": results,
+            "images": len(image_bytes),
+            "unique_images": len(first_position),
+            "failed_images": len(errors),
             "model": "InsightFace ArcFace",
+            "profile": profile or config.DEFAULT_PROFILE,
             "status": "success"
         }
         
@@ -158,13 +687,190 @@ async def verify_faces(
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def get_template_store():
+    check_ready()
+    if template_store is None:
+        raise HTTPException(status_code=500, detail="Template store not loaded")
+    return template_store
+
+@app.post("/enroll")
+async def enroll(
+    image: UploadFile = File(...),
+    template_id: str = Form(None, description="Template id to use (generated when omitted)"),
+    profile: str = Query(None, description="Pipeline profile (defaults to FACE_DEFAULT_PROFILE)"),
+    aligned: bool = Query(False, description="Images are aligned face crops: skip face detection"),
+    det_size: int = Query(None, description="Detector input size (one of FACE_DET_SIZES); chosen per image when omitted")
+):
+    """Enroll a face image and return its template id"""
+    store = get_template_store()
+    
+    try:
+        image_bytes = await read_upload(image)
+        embedding = await extract_embedding(image_bytes, "image", profile, aligned, det_size)
+        
+        # Persist the template (fsync) off the event loop
+        with metrics.stage("store"):
+            template_id = await run_in_threadpool(store.add, embedding, template_id)
+        # len() refreshes from disk, so it stays off the loop too
+        templates = await run_in_threadpool(len, store)
+        
+        return {
+            "template_id": template_id,
+            "templates": templates,
+            "status": "success"
+        }
+        
+    except TemplateExistsError:
+        raise HTTPException(status_code=409, detail=f"Template '{template_id}' already exists")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/verify/{template_id}")
+async def verify_template(
+    template_id: str,
+    image: UploadFile = File(...),
+    profile: str = Query(None, description="Pipeline profile (defaults to FACE_DEFAULT_PROFILE)"),
+    aligned: bool = Query(False, description="Images are aligned face crops: skip face detection"),
+    det_size: int = Query(None, description="Detector input size (one of FACE_DET_SIZES); chosen per image when omitted")
+):
+    """Compare a probe image with an enrolled template"""
+    # get() picks up other workers' enrollments from disk first
+    template = await run_in_threadpool(get_template_store().get, template_id)
+    if template is None:
+        raise HTTPException(status_code=404, detail=f"Template '{template_id}' not found")
+    
+    try:
+        image_bytes = await read_upload(image)
+        embedding = await extract_embedding(image_bytes, "image", profile, aligned, det_size)
+        
+        with metrics.stage("score"):
+            similarity_score = similarity_to_percent(np.dot(template, embedding))
+        
+        result = verification_result(similarity_score, profile)
+        result["template_id"] = template_id
+        return result
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.get("/health")
 def health_check():
-    return {
-        "status": "healthy",
+    """Liveness and readiness: 503 until the models are loaded and warm"""
+    ready = readiness["state"] == "ready"
+    content = {
+        "status": "healthy" if ready else "unavailable",
+        "state": readiness["state"],
+        "load_seconds": readiness["load_seconds"],
+        "warmup_seconds": readiness["warmup_seconds"],
         "service": "face_verification",
-        "model_loaded": face_model is not None
+        "model_loaded": models_loaded(),
+        "model_name": config.MODEL_NAME,
+        "default_profile": config.DEFAULT_PROFILE,
+        "inference": config.INFERENCE_MODE,
+        "workers": serving_workers(),
+        "profiles": serving_profiles(),
+        "det_sizes": config.DET_SIZES,
+        "templates": len(template_store) if template_store is not None else 0
+    }
+    if readiness["error"]:
+        content["error"] = readiness["error"]
+    return content if ready else JSONResponse(status_code=503, content=content)
+
+@app.get("/metrics")
+def prometheus_metrics():
+    """Prometheus metrics of this process: request and stage latencies, counters and queue depths"""
+    return Response(metrics.REGISTRY.render(), media_type=metrics.CONTENT_TYPE)
+
+def check_admin(token):
+    """Reject admin requests without the configured FACE_ADMIN_TOKEN"""
+    if not config.ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled (set FACE_ADMIN_TOKEN)")
+    if token is None or not hmac.compare_digest(token, config.ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+@app.post("/admin/profile")
+async def profile_process(
+    seconds: float = Query(10, gt=0, description="How long to sample"),
+    interval_ms: float = Query(10, ge=1, le=1000, description="Time between samples"),
+    idle: bool = Query(False, description="Keep samples of threads waiting for work"),
+    x_admin_token: str = Header(None)
+):
+    """Sample this process's stacks for a while and return them as collapsed stacks (flamegraph input)"""
+    check_admin(x_admin_token)
+    if seconds > config.PROFILE_MAX_SECONDS:
+        raise HTTPException(status_code=400, detail=f"seconds must be at most {config.PROFILE_MAX_SECONDS:g}")
+    try:
+        stacks = await run_in_threadpool(profiler.sample, seconds, interval_ms / 1000, idle)
+    except profiler.ProfilerBusyError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return Response(stacks, media_type="text/plain", headers={"X-Process-Id": str(os.getpid())})
+
+@app.post("/identify")
+async def identify(
+    image: UploadFile = File(...),
+    top_k: int = Query(5, ge=1, le=100, description="Number of matches to return"),
+    nprobe: int = Query(None, ge=1, description="IVF lists to scan (approximate index only)"),
+    profile: str = Query(None, description="Pipeline profile (defaults to FACE_DEFAULT_PROFILE)"),
+    aligned: bool = Query(False, description="Images are aligned face crops: skip face detection"),
+    det_size: int = Query(None, description="Detector input size (one of FACE_DET_SIZES); chosen per image when omitted")
+):
+    """Search the enrolled gallery for the templates closest to a probe image"""
+    store = get_template_store()
+    
+    try:
+        image_bytes = await read_upload(image)
+        embedding = await extract_embedding(image_bytes, "image", profile, aligned, det_size)
+        
+        # Gallery search (exact matrix-vector product or IVF), off the event loop
+        with metrics.stage("search"):
+            matches = await run_in_threadpool(store.search, embedding, top_k, nprobe)
+        gallery_size = await run_in_threadpool(len, store)
+        
+        results = []
+        for template_id, similarity in matches:
+            similarity_score = similarity_to_percent(similarity)
+            results.append({
+                "template_id": template_id,
+                "similarity_score": similarity_score,
+                "is_same_person": similarity_score > 65.0
+            })
+        
+        return {
+            "matches": results,
+            "gallery_size": gallery_size,
+            "model": "InsightFace ArcFace",
+            "profile": profile or config.DEFAULT_PROFILE,
+            "status": "success"
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/stats")
+def stats():
+    """Runtime statistics for tuning the inference pipeline"""
+    return {
+        "workers": serving_workers(),
+        "profiles": serving_profiles(),
+        "inference": config.INFERENCE_MODE,
+        "batching": batcher.stats() if batcher is not None else None,
+        "cache": embedding_cache.stats(),
+        "gallery": template_store.stats() if template_store is not None else None,
+        "process": {"pid": os.getpid(), "memory": process_memory()}
     }
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    if config.INFERENCE_MODE == "shm":
+        serve_with_inference_process()
+    elif config.PROCESSES > 1:
+        prefork.serve(app, config.PROCESSES, preload=preload_models)
+    else:
+        uvicorn.run(app, host=config.HOST, port=config.PORT)
\ No newline at end of file
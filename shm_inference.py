@@ -0,0 +1,392 @@
+"""
+Shared-memory transport between API workers and a dedicated inference process
+API workers decode uploads and write the BGR pixels into a ring buffer; the
+inference process detects, aligns and embeds them and writes the embedding
+back through a second ring. Nothing is pickled: both sides copy raw bytes
+in and out of shared memory.
+
+Each API worker owns one channel (a request ring and a response ring), so
+every ring has exactly one producer process and one consumer process. A
+shared doorbell semaphore wakes the inference process whenever any worker
+has written a request. Rings, semaphores and the doorbell are created by
+the pre-fork master and inherited by every child.
+"""
+
+import itertools
+import math
+import multiprocessing
+import os
+import struct
+import threading
+import time
+from concurrent.futures import Future, InvalidStateError
+from multiprocessing import shared_memory
+
+import cv2
+import numpy as np
+
+# Producer and consumer positions at the start of every ring segment
+RING_HEADER = struct.Struct('QQ')
+
+# Request id, deadline (time.monotonic(), 0 = none), height, width,
+# det_size (0 = auto), profile index, flags, label
+REQUEST_HEADER = struct.Struct('QdIIIII64s')
+FLAG_ALIGNED = 1
+
+# Request id, status (0 = ok, else an HTTP status code), payload bytes
+RESPONSE_HEADER = struct.Struct('QiI')
+RESPONSE_SLOT_BYTES = 16384
+RESPONSE_SLOTS = 64
+
+
+class InferenceError(Exception):
+    """Failure reported by the inference process for one request"""
+
+    def __init__(self, status, detail):
+        super().__init__(detail)
+        self.status = status
+        self.detail = detail
+
+
+class ShmRing:
+    """Single-producer, single-consumer ring of fixed-size slots
+
+    Positions live in the segment header, so a restarted producer or
+    consumer resumes where its predecessor stopped. The filled / free
+    semaphores only wake the consumer and the producer: the header is the
+    source of truth, and a token that does not match it is skipped.
+    """
+
+    def __init__(self, slots, slot_bytes, ctx):
+        self.slots = slots
+        self.slot_bytes = slot_bytes
+        self.shm = shared_memory.SharedMemory(create=True, size=RING_HEADER.size + slots * slot_bytes)
+        self.buffer = np.ndarray((self.shm.size,), dtype=np.uint8, buffer=self.shm.buf)
+        RING_HEADER.pack_into(self.buffer, 0, 0, 0)
+        self.filled = ctx.Semaphore(0)
+        self.free = ctx.Semaphore(slots)
+
+    def _slot(self, position):
+        start = RING_HEADER.size + (position % self.slots) * self.slot_bytes
+        return self.buffer[start:start + self.slot_bytes]
+
+    def _positions(self):
+        return RING_HEADER.unpack_from(self.buffer, 0)
+
+    def _acquire(self, semaphore, ready, block, timeout):
+        """Take a token from semaphore until ready(produced, consumed) holds; the position to use or None"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            if not semaphore.acquire(block, remaining):
+                return None
+            produced, consumed = self._positions()
+            if ready(produced, consumed):
+                return produced, consumed
+            # Surplus token left by recover(); wait for a real one
+
+    @property
+    def unread(self):
+        """Slots written and not yet released by the consumer"""
+        produced, consumed = self._positions()
+        return produced - consumed
+
+    def recover(self):
+        """Rebuild both semaphores from the header positions; returns the unread slot count
+
+        A process that died between taking and returning a token left the
+        counts out of step with the header. Call this when a producer or
+        consumer (re)starts. If the peer is active meanwhile this can only
+        leave surplus tokens, which reserve() and peek() skip.
+        """
+        for semaphore in (self.filled, self.free):
+            while semaphore.acquire(False):
+                pass
+        produced, consumed = self._positions()
+        unread = produced - consumed
+        for _ in range(unread):
+            self.filled.release()
+        for _ in range(self.slots - unread):
+            self.free.release()
+        return unread
+
+    def reserve(self, timeout=None):
+        """Next slot to write, or None if the ring stayed full for timeout seconds"""
+        positions = self._acquire(self.free, lambda p, c: p - c < self.slots, True, timeout)
+        return None if positions is None else self._slot(positions[0])
+
+    def commit(self):
+        """Publish the reserved slot to the consumer"""
+        produced, _ = self._positions()
+        struct.pack_into('Q', self.buffer, 0, produced + 1)
+        self.filled.release()
+
+    def peek(self, block=True, timeout=None):
+        """Oldest unread slot, or None if none arrived"""
+        positions = self._acquire(self.filled, lambda p, c: p > c, block, timeout)
+        return None if positions is None else self._slot(positions[1])
+
+    def release(self):
+        """Hand the slot returned by peek() back to the producer"""
+        _, consumed = self._positions()
+        struct.pack_into('Q', self.buffer, 8, consumed + 1)
+        self.free.release()
+
+    def unlink(self):
+        self.buffer = None
+        self.shm.close()
+        self.shm.unlink()
+
+
+class InferenceChannel:
+    """Request and response rings between one API worker and the inference process
+
+    generation counts inference process starts, so the worker can tell that
+    requests sent to a previous inference process will never be answered.
+    crop_size is the recognition input size, published by the inference
+    process so workers can prepare aligned crops the same way it would.
+    """
+
+    def __init__(self, ctx, slots, slot_bytes):
+        self.requests = ShmRing(slots, slot_bytes, ctx)
+        self.responses = ShmRing(RESPONSE_SLOTS, RESPONSE_SLOT_BYTES, ctx)
+        self.generation = ctx.Value('Q', 0)
+        self.crop_size = ctx.Value('I', 0)
+
+    @property
+    def max_image_bytes(self):
+        return self.requests.slot_bytes - REQUEST_HEADER.size
+
+    def unlink(self):
+        self.requests.unlink()
+        self.responses.unlink()
+
+
+def create_channels(workers, slots, slot_bytes):
+    """One channel per API worker plus the shared doorbell (call before forking)"""
+    ctx = multiprocessing.get_context('fork')
+    channels = [InferenceChannel(ctx, slots, slot_bytes) for _ in range(workers)]
+    return channels, ctx.Semaphore(0)
+
+
+def fit_to_bytes(img, max_bytes):
+    """Downscale img so its pixels fit in max_bytes"""
+    if img.nbytes <= max_bytes:
+        return img
+    scale = math.sqrt(max_bytes / img.nbytes) * 0.999
+    size = (max(1, int(img.shape[1] * scale)), max(1, int(img.shape[0] * scale)))
+    return cv2.resize(img, size, interpolation=cv2.INTER_AREA)
+
+
+class InferenceClient:
+    """API worker side: submit decoded images, receive embeddings as Futures
+
+    Any thread may submit; a reader thread resolves the Futures as responses
+    arrive, matching them by request id. When the inference process is
+    restarted, requests sent to its predecessor fail with status 503.
+    """
+
+    def __init__(self, channel, doorbell):
+        self.channel = channel
+        self.doorbell = doorbell
+        self._ids = itertools.count((os.getpid() << 32) + 1)
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        """Start the response reader (in the worker, after the fork)"""
+        # A predecessor of this worker may have died holding ring tokens
+        for _ in range(self.channel.requests.recover()):
+            self.doorbell.release()
+        self.channel.responses.recover()
+        self._thread = threading.Thread(target=self._read_responses, name="shm-responses", daemon=True)
+        self._thread.start()
+
+    @property
+    def crop_size(self):
+        """Recognition input size (0 until an inference process has started)"""
+        return self.channel.crop_size.value
+
+    @property
+    def pending(self):
+        """Requests submitted and not answered yet"""
+        return len(self._pending)
+
+    def submit(self, img, image_label, profile_index=0, det_size=None, aligned=False, timeout=None):
+        """Write one BGR image to the request ring; returns (request id, Future of its embedding)
+
+        timeout bounds the wait for a free slot and, from then on, how long
+        the request is worth running: the inference process drops it after.
+        """
+        img = np.ascontiguousarray(fit_to_bytes(img, self.channel.max_image_bytes))
+        future = Future()
+        with self._lock:
+            slot = self.channel.requests.reserve(timeout)
+            if slot is None:
+                raise TimeoutError("Inference queue is full")
+            request_id = next(self._ids)
+            # CLOCK_MONOTONIC is system-wide on Linux, so the inference process can compare it
+            deadline = time.monotonic() + timeout if timeout else 0.0
+            REQUEST_HEADER.pack_into(
+                slot, 0, request_id, deadline, img.shape[0], img.shape[1], det_size or 0,
+                profile_index, FLAG_ALIGNED if aligned else 0, image_label.encode()[:64]
+            )
+            slot[REQUEST_HEADER.size:REQUEST_HEADER.size + img.nbytes] = img.reshape(-1)
+            self._pending[request_id] = (future, self.channel.generation.value)
+            self.channel.requests.commit()
+        self.doorbell.release()
+        return request_id, future
+
+    def cancel(self, request_id):
+        """Stop waiting for a request (timed out or abandoned); a late response is dropped"""
+        with self._lock:
+            entry = self._pending.pop(request_id, None)
+        if entry is not None:
+            entry[0].cancel()
+
+    def _fail_previous_generations(self, generation):
+        """Fail requests sent before the inference process was (re)started
+
+        Generation 0 means no inference process had started yet: those
+        requests are still unread in the ring and the new process answers them.
+        """
+        with self._lock:
+            lost = [request_id for request_id, (_, sent) in self._pending.items() if 0 < sent < generation]
+            futures = [self._pending.pop(request_id)[0] for request_id in lost]
+        for future in futures:
+            try:
+                future.set_exception(InferenceError(503, "Inference process restarted"))
+            except InvalidStateError:
+                pass
+
+    def _read_responses(self):
+        responses = self.channel.responses
+        generation = self.channel.generation.value
+        while True:
+            if self.channel.generation.value != generation:
+                generation = self.channel.generation.value
+                self._fail_previous_generations(generation)
+            slot = responses.peek(timeout=1.0)
+            if slot is None:
+                continue
+            request_id, status, length = RESPONSE_HEADER.unpack_from(slot, 0)
+            payload = slot[RESPONSE_HEADER.size:RESPONSE_HEADER.size + length]
+            if status == 0:
+                result = payload.view(np.float32).copy()
+            else:
+                result = InferenceError(status, payload.tobytes().decode(errors='replace'))
+            responses.release()
+
+            # Responses to cancelled requests or to a previous incarnation of this worker have no Future
+            with self._lock:
+                entry = self._pending.pop(request_id, None)
+            if entry is None:
+                continue
+            try:
+                if isinstance(result, InferenceError):
+                    entry[0].set_exception(result)
+                else:
+                    entry[0].set_result(result)
+            except InvalidStateError:
+                # Cancelled by its waiter in the meantime
+                pass
+
+
+class InferenceServer:
+    """Inference process side: read requests from every channel, write responses
+
+    handle(img, image_label, profile_index, det_size, aligned) must return a
+    Future of a float32 embedding; it is resolved on any thread.
+
+    A worker's requests hold a permit from when they are read until their
+    response is written, so at most as many as its ring has slots are being
+    processed at once; the rest wait in the ring. Requests past their
+    deadline are dropped unread, and a response that cannot be written
+    within reply_timeout seconds is dropped.
+    """
+
+    def __init__(self, channels, doorbell, reply_timeout=30.0):
+        self.channels = channels
+        self.doorbell = doorbell
+        self.reply_timeout = reply_timeout
+        self._response_locks = [threading.Lock() for _ in channels]
+        self._permits = [threading.Semaphore(channel.requests.slots) for channel in channels]
+        self._next = 0
+
+    def _next_request(self):
+        """Wait for the doorbell, then take a request round-robin across workers with a free permit"""
+        while True:
+            self.doorbell.acquire()
+            for offset in range(len(self.channels)):
+                index = (self._next + offset) % len(self.channels)
+                # A worker at its limit is skipped; its next finished request rings again
+                if not self._permits[index].acquire(False):
+                    continue
+                slot = self.channels[index].requests.peek(block=False)
+                if slot is not None:
+                    self._next = index + 1
+                    return index, slot
+                self._permits[index].release()
+
+    def _finish(self, index):
+        """Return a request's permit, waking the reader if the worker has more waiting"""
+        self._permits[index].release()
+        if self.channels[index].requests.unread:
+            self.doorbell.release()
+
+    def serve(self, handle):
+        for channel in self.channels:
+            # A previous process may have died holding ring tokens; one doorbell per unread request
+            for _ in range(channel.requests.recover()):
+                self.doorbell.release()
+            channel.responses.recover()
+            # Tell every worker that requests sent to a previous process are lost
+            with channel.generation.get_lock():
+                channel.generation.value += 1
+        while True:
+            index, slot = self._next_request()
+            request_id, deadline, height, width, det_size, profile_index, flags, label = REQUEST_HEADER.unpack_from(slot, 0)
+            if deadline and time.monotonic() > deadline:
+                # The worker has stopped waiting for it
+                self.channels[index].requests.release()
+                self._finish(index)
+                continue
+            pixels = slot[REQUEST_HEADER.size:REQUEST_HEADER.size + height * width * 3]
+            # Copy out so the worker can reuse the slot while this image is processed
+            img = pixels.reshape(height, width, 3).copy()
+            self.channels[index].requests.release()
+
+            image_label = label.rstrip(b'\0').decode(errors='replace')
+            try:
+                future = handle(img, image_label, profile_index, det_size or None, bool(flags & FLAG_ALIGNED))
+            except Exception as e:
+                future = Future()
+                future.set_exception(e)
+            future.add_done_callback(lambda f, index=index, request_id=request_id: self._respond(index, request_id, f))
+
+    def _respond(self, index, request_id, future):
+        try:
+            self._write_response(index, request_id, future)
+        finally:
+            self._finish(index)
+
+    def _write_response(self, index, request_id, future):
+        error = future.exception()
+        if error is None:
+            status, payload = 0, np.asarray(future.result(), dtype=np.float32).tobytes()
+        else:
+            status = getattr(error, 'status_code', None) or getattr(error, 'status', None) or 500
+            payload = str(getattr(error, 'detail', None) or error).encode()
+        payload = payload[:RESPONSE_SLOT_BYTES - RESPONSE_HEADER.size]
+
+        with self._response_locks[index]:
+            responses = self.channels[index].responses
+            slot = responses.reserve(self.reply_timeout)
+            if slot is None:
+                # The worker is not reading responses; its waiter times out on its own
+                print(f"⚠️  Response ring of worker {index} full for {self.reply_timeout:g}s, dropping a response")
+                return
+            RESPONSE_HEADER.pack_into(slot, 0, request_id, status, len(payload))
+            slot[RESPONSE_HEADER.size:RESPONSE_HEADER.size + len(payload)] = np.frombuffer(payload, dtype=np.uint8)
+            responses.commit()
@@ -0,0 +1,455 @@
+"""
+Persistent store of enrolled face templates
+Templates are normalized embeddings kept in one contiguous matrix in memory
+"""
+
+import json
+import os
+import re
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+
+from ann_index import ExactIndex, create_index, load_index, top_k_cosine
+
+# Template ids are stored one per line, so keep them to a safe charset
+TEMPLATE_ID_PATTERN = re.compile(r'^[A-Za-z0-9_.:@-]{1,128}$')
+
+
+# Retrain an approximate index once the gallery has doubled since training,
+# so its centroids keep following the data
+INDEX_RETRAIN_GROWTH = 2.0
+
+
+class TemplateExistsError(Exception):
+    """Raised when enrolling a template id that is already taken"""
+
+
+class TemplateStore:
+    """Append-only on-disk template store
+
+    Layout of the store directory:
+        meta.json       - embedding dimension and model set
+        embeddings.f32  - raw float32 rows, one per template
+        ids.txt         - template ids, one per line, same order as the rows
+
+    Rows are appended before ids, so after a crash any trailing row without
+    an id is dropped on the next load.
+
+    Searches are exact over the matrix unless an approximate index kind is
+    configured and the gallery has at least index_min_size templates. The
+    index is saved as index_<kind>.npz and caught up with new rows on load.
+    Once running, it is only trained by an enrollment that makes the gallery
+    need one, in a background thread; searches stay exact until it is ready.
+
+    With shared=True several processes can use the same directory: writes
+    and index training are serialized with an exclusive lock on store.lock,
+    and every read picks up rows other processes appended since the last one
+    and the index file when another process saved a new one.
+    """
+
+    def __init__(self, directory, model_name, dim=512, index_kind=ExactIndex.kind,
+                 index_params=None, index_min_size=0, shared=False):
+        self.directory = Path(directory)
+        self.model_name = model_name
+        self.dim = dim
+        self.index_kind = index_kind
+        self.index_params = index_params or {}
+        self.index_min_size = index_min_size
+        self.shared = shared
+        self.index = None
+        self._index_dirty = False
+        self._index_generation = None
+        self._index_builder = None
+        self._lock = threading.Lock()
+        self._ids = []
+        self._rows = {}
+        self._matrix = np.empty((0, dim), dtype=np.float32)
+        self._count = 0
+        self._ids_offset = 0
+        self._search_executor = ThreadPoolExecutor(
+            max_workers=os.cpu_count() or 1,
+            thread_name_prefix="gallery-search"
+        )
+        self.load()
+
+    @property
+    def _embeddings_path(self):
+        return self.directory / "embeddings.f32"
+
+    @property
+    def _ids_path(self):
+        return self.directory / "ids.txt"
+
+    @property
+    def _meta_path(self):
+        return self.directory / "meta.json"
+
+    @property
+    def _index_path(self):
+        return self.directory / f"index_{self.index_kind}.npz"
+
+    @property
+    def _lock_path(self):
+        return self.directory / "store.lock"
+
+    @property
+    def _wants_index(self):
+        return self.index_kind != ExactIndex.kind and self._count >= max(1, self.index_min_size)
+
+    @contextmanager
+    def _file_lock(self):
+        """Exclusive lock across processes sharing the directory (no-op otherwise)"""
+        if not self.shared:
+            yield
+            return
+        import fcntl
+        with open(self._lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def load(self):
+        """Read templates from disk"""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with self._file_lock():
+            self._load_files()
+            self._load_index()
+
+    def _load_files(self):
+        if self._meta_path.exists():
+            meta = json.loads(self._meta_path.read_text())
+            if meta['model'] != self.model_name or meta['dim'] != self.dim:
+                raise ValueError(
+                    f"Template store {self.directory} was built with {meta['model']} "
+                    f"({meta['dim']}-d), server is running {self.model_name} ({self.dim}-d)"
+                )
+        else:
+            self._meta_path.write_text(json.dumps({'model': self.model_name, 'dim': self.dim}))
+
+        ids = []
+        if self._ids_path.exists():
+            ids_text = self._ids_path.read_bytes()
+            complete = ids_text[:ids_text.rfind(b'\n') + 1]
+            if len(complete) != len(ids_text):
+                # Drop an id cut short by a crash, or the next append would join onto it
+                with open(self._ids_path, 'r+b') as f:
+                    f.truncate(len(complete))
+            self._ids_offset = len(complete)
+            ids = [line for line in complete.decode().splitlines() if line]
+        embeddings = np.empty((0, self.dim), dtype=np.float32)
+        if self._embeddings_path.exists():
+            embeddings = np.fromfile(self._embeddings_path, dtype=np.float32)
+            embeddings = embeddings[:embeddings.size // self.dim * self.dim].reshape(-1, self.dim)
+
+        count = min(len(ids), len(embeddings))
+        if len(embeddings) != count:
+            # Drop rows left behind by an interrupted enrollment
+            with open(self._embeddings_path, 'r+b') as f:
+                f.truncate(count * self.dim * 4)
+
+        self._ids = ids[:count]
+        self._rows = {template_id: row for row, template_id in enumerate(self._ids)}
+        self._matrix = np.array(embeddings[:count], dtype=np.float32)
+        self._count = count
+
+    def refresh(self):
+        """Pick up templates appended by other processes (shared stores only)
+
+        Rows are written before ids, so every complete new id line already
+        has its row on disk.
+        """
+        if not self.shared:
+            return
+        self._read_rows()
+        self._follow_saved_index()
+
+    def _read_rows(self):
+        """Append rows other processes enrolled since the last read"""
+        try:
+            if os.path.getsize(self._ids_path) <= self._ids_offset:
+                return
+        except OSError:
+            return
+
+        with self._lock:
+            with open(self._ids_path, 'rb') as f:
+                f.seek(self._ids_offset)
+                appended = f.read()
+            complete = appended[:appended.rfind(b'\n') + 1]
+            new_ids = [line for line in complete.decode().splitlines() if line]
+            if not new_ids:
+                return
+            with open(self._embeddings_path, 'rb') as f:
+                f.seek(self._count * self.dim * 4)
+                rows = np.fromfile(f, dtype=np.float32, count=len(new_ids) * self.dim)
+            rows = rows.reshape(len(new_ids), self.dim)
+
+            self._reserve(self._count + len(new_ids))
+            self._matrix[self._count:self._count + len(new_ids)] = rows
+            for template_id in new_ids:
+                self._rows[template_id] = self._count
+                self._ids.append(template_id)
+                self._count += 1
+            self._ids_offset += len(complete)
+
+            if self.index is not None:
+                self.index.add(rows)
+                self._index_dirty = True
+
+    def _reserve(self, rows):
+        """Grow the matrix geometrically so enrollment stays amortized O(1)"""
+        if rows > len(self._matrix):
+            grown = np.empty((max(1024, 2 * len(self._matrix), rows), self.dim), dtype=np.float32)
+            grown[:self._count] = self._matrix[:self._count]
+            self._matrix = grown
+
+    def _index_file_generation(self):
+        """Identity of the saved index file; changes whenever a process replaces it"""
+        try:
+            stat = os.stat(self._index_path)
+        except OSError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def _read_saved_index(self):
+        """Saved index if it fits the current gallery (never trains), else None"""
+        generation = self._index_file_generation()
+        if generation is None:
+            return None
+        index = load_index(self._index_path)
+        if index.kind != self.index_kind or index.ntotal > self._count:
+            return None
+        # Search-time parameters come from the configuration, not the file
+        if 'nprobe' in self.index_params:
+            index.nprobe = self.index_params['nprobe']
+        self._index_generation = generation
+        return index
+
+    def _use_index(self, index):
+        """Make index current, catching it up with rows enrolled after it was saved"""
+        with self._lock:
+            if index.ntotal < self._count:
+                index.add(self._matrix[index.ntotal:self._count])
+                self._index_dirty = True
+            self.index = index
+
+    def _load_index(self):
+        """Load the saved approximate index, or train one (caller holds the file lock)
+
+        Training here keeps the lock on purpose: workers starting together
+        wait for one build instead of each training their own.
+        """
+        self.index = None
+        if not self._wants_index:
+            return
+
+        index = self._read_saved_index()
+        if index is not None and self._count > INDEX_RETRAIN_GROWTH * getattr(index, 'trained_size', self._count):
+            print(f"🔄 Gallery grew to {self._count} templates, retraining {self.index_kind} index")
+            index = None
+
+        if index is None:
+            self._train_index()
+        else:
+            self._use_index(index)
+
+    def _follow_saved_index(self):
+        """Switch to an index another process saved since this one last looked"""
+        if self.index_kind == ExactIndex.kind:
+            return
+        generation = self._index_file_generation()
+        if generation is None or generation == self._index_generation:
+            return
+        try:
+            index = self._read_saved_index()
+        except Exception as e:
+            print(f"⚠️  Could not load {self._index_path}: {e}")
+            self._index_generation = generation
+            return
+        if index is not None:
+            self._use_index(index)
+
+    def _start_index_build(self):
+        """Train the index in the background unless a build is already running"""
+        with self._lock:
+            if self._index_builder is not None and self._index_builder.is_alive():
+                return
+            self._index_builder = threading.Thread(target=self._build_index, name="gallery-index", daemon=True)
+            self._index_builder.start()
+
+    def _build_index(self):
+        """Background build: reuse an index another process saved, or train one without the file lock"""
+        try:
+            if self.shared:
+                self.refresh()
+                index = self._read_saved_index()
+                if index is not None:
+                    self._use_index(index)
+                    return
+            self._install_index(self._fit_index(), keep_newer=self.shared)
+        except Exception as e:
+            print(f"❌ Building the {self.index_kind} index failed: {e}")
+
+    def _fit_index(self):
+        """New index trained on a snapshot of the gallery (no locks held while training)"""
+        with self._lock:
+            # Rows are never rewritten, so the snapshot stays valid if _reserve reallocates
+            matrix, count = self._matrix, self._count
+        index = create_index(self.index_kind, self.dim, **self.index_params)
+        index.build(matrix[:count])
+        return index
+
+    def _install_index(self, index, keep_newer=False):
+        """Under the file lock, catch a trained index up with rows enrolled since its snapshot and save it
+
+        With keep_newer=True an index another process saved meanwhile wins
+        if it was trained on at least as many rows.
+        """
+        with self._file_lock():
+            if self.shared:
+                self._read_rows()
+            if keep_newer:
+                saved = self._read_saved_index()
+                if saved is not None and getattr(saved, 'trained_size', 0) >= getattr(index, 'trained_size', index.ntotal):
+                    self._use_index(saved)
+                    return
+            self._use_index(index)
+            with self._lock:
+                self._index_dirty = True
+            self._write_index()
+
+    def _train_index(self):
+        """Train the approximate index on the current gallery and save it (caller holds the file lock)"""
+        index = self._fit_index()
+        self._use_index(index)
+        with self._lock:
+            self._index_dirty = True
+        self._write_index()
+
+    def rebuild_index(self):
+        """Train the approximate index on the current gallery and save it"""
+        self._install_index(self._fit_index())
+
+    def save_index(self):
+        """Write the approximate index next to the templates"""
+        with self._file_lock():
+            self._write_index()
+
+    def _write_index(self):
+        """Write the index file if it changed (caller holds the file lock)"""
+        with self._lock:
+            index, dirty = self.index, self._index_dirty
+            self._index_dirty = False
+        if index is None or not dirty:
+            return
+        tmp_path = self._index_path.with_suffix(f'.{os.getpid()}.tmp')
+        with open(tmp_path, 'wb') as f:
+            index.save(f)
+        os.replace(tmp_path, self._index_path)
+        self._index_generation = self._index_file_generation()
+
+    def close(self):
+        self.save_index()
+        self._search_executor.shutdown(wait=False)
+
+    def __len__(self):
+        self.refresh()
+        return self._count
+
+    def __contains__(self, template_id):
+        self.refresh()
+        return template_id in self._rows
+
+    @property
+    def embeddings(self):
+        """(n, dim) matrix of all templates, row order matching ids"""
+        return self._matrix[:self._count]
+
+    @property
+    def ids(self):
+        return self._ids
+
+    def get(self, template_id):
+        """Embedding of a template, or None if it is not enrolled"""
+        self.refresh()
+        row = self._rows.get(template_id)
+        return None if row is None else self._matrix[row]
+
+    def add(self, embedding, template_id=None):
+        """Enroll a normalized embedding and persist it; returns the template id"""
+        if template_id is None:
+            template_id = uuid.uuid4().hex
+        if not TEMPLATE_ID_PATTERN.match(template_id):
+            raise ValueError("Template id must be 1-128 characters of [A-Za-z0-9_.:@-]")
+        embedding = np.asarray(embedding, dtype=np.float32).reshape(self.dim)
+
+        with self._file_lock():
+            # Other processes' enrollments count for the duplicate check
+            self.refresh()
+            self._append(embedding, template_id)
+
+        if self.index is None and self._wants_index:
+            # Training can take a while: never inside the enrollment request
+            self._start_index_build()
+        return template_id
+
+    def _append(self, embedding, template_id):
+        """Write one template to disk and memory (caller holds the file lock)"""
+        with self._lock:
+            if template_id in self._rows:
+                raise TemplateExistsError(template_id)
+
+            self._reserve(self._count + 1)
+
+            with open(self._embeddings_path, 'ab') as f:
+                f.write(embedding.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            line = (template_id + '\n').encode()
+            with open(self._ids_path, 'ab') as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+
+            self._matrix[self._count] = embedding
+            self._rows[template_id] = self._count
+            self._ids.append(template_id)
+            self._count += 1
+            self._ids_offset += len(line)
+
+            if self.index is not None:
+                self.index.add(embedding)
+                self._index_dirty = True
+
+    def search(self, probe, k=5, nprobe=None):
+        """Top-k enrolled templates for a normalized probe
+
+        nprobe overrides the approximate index's lists scanned per query.
+        Returns a list of (template_id, cosine similarity), best first.
+        """
+        self.refresh()
+        with self._lock:
+            matrix, count, index = self._matrix, self._count, self.index
+        probe = np.asarray(probe, dtype=np.float32).reshape(self.dim)
+        if index is not None:
+            rows, scores = index.search(probe, k, self._search_executor, nprobe=nprobe, vectors=matrix)
+        else:
+            rows, scores = top_k_cosine(matrix[:count], probe, k, self._search_executor)
+        return [(self._ids[row], float(score)) for row, score in zip(rows, scores)]
+
+    def stats(self):
+        self.refresh()
+        index = self.index
+        return {
+            "templates": self._count,
+            "index": index.kind if index is not None else ExactIndex.kind,
+            "index_params": index.params if index is not None else {},
+            "indexed": index.ntotal if index is not None else self._count
+        }